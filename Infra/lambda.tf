@@ -36,6 +36,12 @@ resource "aws_iam_policy_attachment" "attach_ses_full_access" {
   policy_arn = "arn:aws:iam::aws:policy/AmazonSESFullAccess"
 }
 
+resource "aws_iam_policy_attachment" "attach_sqs_full_access" {
+  name       = "attach_sqs_full_access"
+  roles      = [aws_iam_role.vl_lambda_role.name]
+  policy_arn = "arn:aws:iam::aws:policy/AmazonSQSFullAccess"
+}
+
 resource "aws_lambda_layer_version" "db_lambda_layer" {
   filename         = "../db_lambda_layersV1.zip"
   layer_name       = "db_lambda_layer"
@@ -132,6 +138,8 @@ resource "aws_lambda_function" "lambda" {
       DB_NAME     = "postgres"
       RSS_FEED_URLS = jsonencode(var.rss_feed_urls)
       API_KEY     = var.api_key
+      FEED_QUEUE_URL = var.feed_worker_mode ? aws_sqs_queue.rss_feed_jobs.url : ""
+      TIKTOKEN_CACHE_DIR = "/opt/tiktoken_cache"
     }
   }
   vpc_config {
@@ -423,4 +431,28 @@ resource "aws_lambda_permission" "allow_cloudwatch_to_invoke_rss_handler" {
   function_name = aws_lambda_function.lambda.function_name
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.rss_handler_schedule.arn
-}
\ No newline at end of file
+}
+
+# Per-feed jobs for the RSS handler's worker mode (enabled with var.feed_worker_mode)
+resource "aws_sqs_queue" "rss_feed_jobs_dlq" {
+  name                      = "rss-feed-jobs-dlq"
+  message_retention_seconds = 1209600
+}
+
+resource "aws_sqs_queue" "rss_feed_jobs" {
+  name                       = "rss-feed-jobs"
+  # Must be at least the RSS lambda timeout
+  visibility_timeout_seconds = 300
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.rss_feed_jobs_dlq.arn
+    maxReceiveCount     = 3
+  })
+}
+
+resource "aws_lambda_event_source_mapping" "rss_feed_jobs_worker" {
+  event_source_arn        = aws_sqs_queue.rss_feed_jobs.arn
+  function_name           = aws_lambda_function.lambda.arn
+  batch_size              = 1
+  enabled                 = var.feed_worker_mode
+  function_response_types = ["ReportBatchItemFailures"]
+}
@@ -56,4 +56,10 @@ variable "perplexity_api_url" {
   description = "Perplexity AI API URL"
   type        = string
   default     = "https://api.perplexity.ai/chat/completions"
-}
\ No newline at end of file
+}
+
+variable "feed_worker_mode" {
+  description = "Run the RSS handler as coordinator + per-feed SQS workers instead of one invocation"
+  type        = bool
+  default     = false
+}
@@ -0,0 +1,271 @@
+"""Offline replay benchmark for the feed parser pipeline.
+
+Serves recorded feeds, article pages and canned LLM answers from local HTTP
+stand-ins, runs process_feeds and send_pending_digests against them as the
+inline scheduled run does, and reports the time of each pipeline stage (from
+the run's metrics timers), peak Python memory and LLM calls.
+
+    DB_HOST=localhost DB_NAME=vendex_bench DB_USER=postgres DB_PASS=postgres \\
+        python benchmarks/feed_parser/replay.py --copies 10 --rounds 3
+
+With --budget the run gets a Lambda-style deadline of that many seconds, so
+the checkpointing of unfinished articles can be measured too.
+
+The pipeline needs Postgres, configured through the same DB_* variables as the
+lambda. Each round runs inside a transaction that is rolled back, so tables
+are created and seeded on the fly and nothing is left behind. SES is served
+by moto.
+"""
+import os
+import sys
+import re
+import json
+import time
+import argparse
+import threading
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+FIXTURES = HERE / "fixtures"
+sys.path.insert(0, str(HERE.parents[1] / "feed_parser_lambda"))
+
+# Every stand-in lives on 127.0.0.1, so per-host spacing would only measure sleeps
+os.environ.setdefault("HOST_MIN_DELAY", "0")
+os.environ.setdefault("HOST_MAX_CONCURRENCY", "8")
+for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+    os.environ.setdefault(name, "testing")
+
+import boto3
+from moto import mock_aws
+
+import parser as feed_parser
+from checkpoint import Deadline
+from metrics import metrics
+from sender import SENDER_EMAIL
+from models import (
+    db, RSSFeed, Account, Subscriber, SubscriberPreference, Vendor, VendorList,
+    VendorListSubscriber, VendorListVendor, VendorProfile
+)
+from vendors import reset_vendor_index
+
+
+class ReplayServer:
+    """Local stand-in for feed hosts, article pages and the OpenAI API.
+
+    Fixtures are served `copies` times under different paths so a run can be
+    scaled without recording more data. LLM answers are looked up by a phrase
+    from each article in fixtures/llm_responses.json.
+    """
+
+    def __init__(self, fixtures=FIXTURES, copies=1):
+        self.copies = copies
+        self.feeds = {p.stem: p.read_text() for p in sorted((fixtures / "feeds").glob("*.xml"))}
+        self.articles = {p.stem: p.read_bytes() for p in (fixtures / "articles").glob("*.html")}
+        self.responses = json.loads((fixtures / "llm_responses.json").read_text())
+        self.counts = {"feed_requests": 0, "article_requests": 0, "llm_calls": 0, "llm_dupe_checks": 0}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self._server.server_port}"
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def feed_infos(self):
+        return [
+            {"url": f"{self.base}/feeds/{copy}/{name}.xml", "source": f"{name}-{copy}"}
+            for copy in range(self.copies)
+            for name in self.feeds
+        ]
+
+    def render_feed(self, name, copy):
+        published = format_datetime(datetime.now(timezone.utc) - timedelta(hours=1))
+        return (
+            self.feeds[name]
+            .replace("{base}", self.base)
+            .replace("{copy}", str(copy))
+            .replace("{published}", published)
+        )
+
+    def lookup(self, text):
+        for item in self.responses.values():
+            if item["match"] in text:
+                return item["result"]
+        return None
+
+    def answer(self, payload):
+        prompt = next(m["content"] for m in payload["messages"] if m["role"] == "user")
+        if 'Answer with only "YES" or "NO"' in prompt:
+            self.count("llm_dupe_checks")
+            return "NO"
+        self.count("llm_calls")
+        sections = re.split(r"### Article (\d+)\n", prompt)
+        if len(sections) > 1:
+            return json.dumps([
+                {"index": int(index), "result": self.lookup(text)}
+                for index, text in zip(sections[1::2], sections[2::2])
+            ])
+        result = self.lookup(prompt)
+        return json.dumps(result) if result else ""
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_body(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                match = re.fullmatch(r"/(feeds|articles)/(\d+)/([\w-]+)\.(xml|html)", self.path)
+                if match and match.group(1) == "feeds" and match.group(3) in server.feeds:
+                    server.count("feed_requests")
+                    body = server.render_feed(match.group(3), match.group(2)).encode("utf-8")
+                    self.send_body(200, body, "application/rss+xml; charset=utf-8")
+                elif match and match.group(1) == "articles" and match.group(3) in server.articles:
+                    server.count("article_requests")
+                    self.send_body(200, server.articles[match.group(3)], "text/html; charset=utf-8")
+                else:
+                    self.send_body(404, b"", "text/plain")
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                content = server.answer(payload)
+                body = json.dumps({
+                    "choices": [{"message": {"role": "assistant", "content": content}}],
+                    "usage": {
+                        "prompt_tokens": sum(len(m["content"]) for m in payload["messages"]) // 4,
+                        "completion_tokens": len(content) // 4,
+                    },
+                }).encode("utf-8")
+                self.send_body(200, body, "application/json")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def seed_database(seed):
+    db.create_tables([
+        RSSFeed, Account, Subscriber, SubscriberPreference, Vendor, VendorList, VendorListSubscriber,
+        VendorListVendor, VendorProfile
+    ], safe=True)
+    feed_parser.ensure_tables()
+    for profile in seed.get("profiles", []):
+        VendorProfile.create(vendor=profile["vendor"], alias=profile["alias"])
+    vendors = {name: Vendor.create(name=name) for name in seed["vendors"]}
+    subscribers = {}
+    for list_info in seed["lists"]:
+        vendor_list = VendorList.create(name=list_info["name"])
+        for name in list_info["vendors"]:
+            VendorListVendor.create(vendor_list=vendor_list, vendor=vendors[name])
+        for email in list_info["subscribers"]:
+            if email not in subscribers:
+                subscribers[email] = Subscriber.create(email=email, verified=True)
+            VendorListSubscriber.create(vendor_list=vendor_list, subscriber=subscribers[email])
+    for email in seed.get("digest_subscribers", []):
+        SubscriberPreference.create(subscriber=subscribers[email], delivery_mode="digest")
+
+
+def run_round(server, seed, hours, budget=None):
+    """One pass over the fixtures; returns stage timings, counters and totals."""
+    metrics.reset()
+    reset_vendor_index()
+    with db.atomic() as txn:
+        seed_database(seed)
+        deadline = Deadline(budget_ms=budget * 1000) if budget else None
+        before = server.snapshot()
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = feed_parser.process_feeds(server.feed_infos(), hours, False, deadline)
+        digests = feed_parser.send_pending_digests(deadline)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] - start_memory
+        txn.rollback()
+    after = server.snapshot()
+    totals = {
+        "seconds": elapsed,
+        "peak_kib": peak / 1024,
+        **{key: after[key] - before[key] for key in after},
+        "digest_emails": digests,
+        "result": result,
+    }
+    return {name: ms / 1000 for name, ms in metrics.timings.items()}, dict(metrics.counters), totals
+
+
+def report(rounds):
+    mean = lambda values: sum(values) / len(rounds)
+    stage_names = sorted({name for r in rounds for name in r["stages"]})
+    print(f"{'stage':<16}{'seconds':>10}")
+    for name in stage_names:
+        print(f"{name:<16}{mean(r['stages'].get(name, 0) for r in rounds):>10.3f}")
+    articles = sum(r["totals"]["article_requests"] for r in rounds)
+    llm_calls = sum(r["totals"]["llm_calls"] + r["totals"]["llm_dupe_checks"] for r in rounds)
+    print(f"\nrounds: {len(rounds)}  mean wall time: {mean(r['totals']['seconds'] for r in rounds):.3f}s  "
+          f"mean peak: {mean(r['totals']['peak_kib'] for r in rounds):.0f} KiB")
+    print(f"articles per round: {articles / len(rounds):.0f}  "
+          f"LLM calls per article: {llm_calls / articles if articles else 0:.2f}  "
+          f"dupe checks per round: {mean(r['totals']['llm_dupe_checks'] for r in rounds):.1f}")
+    print("last round: " + ", ".join(f"{k}={v}" for k, v in sorted(rounds[-1]["counters"].items())))
+    print(f"last result: {rounds[-1]['totals']['result']} Sent {rounds[-1]['totals']['digest_emails']} digest emails.")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--copies", type=int, default=1, help="serve the fixtures this many times over")
+    arg_parser.add_argument("--rounds", type=int, default=1, help="repeat the run and average the stages")
+    arg_parser.add_argument("--hours", type=int, default=3, help="feed window, as in the scheduled event")
+    arg_parser.add_argument("--budget", type=float, help="give each round a deadline of this many seconds")
+    arg_parser.add_argument("--json", help="also write the raw measurements to this file")
+    args = arg_parser.parse_args()
+    if not os.getenv("DB_NAME"):
+        sys.exit("Set DB_HOST, DB_NAME, DB_USER and DB_PASS to a scratch Postgres database")
+
+    seed = json.loads((FIXTURES / "seed.json").read_text())
+    server = ReplayServer(copies=args.copies).start()
+    feed_parser.API_URL = f"{server.base}/v1/chat/completions"
+    rounds = []
+    tracemalloc.start()
+    try:
+        with mock_aws():
+            ses = boto3.client("ses", region_name="us-east-1")
+            ses.verify_domain_identity(Domain=SENDER_EMAIL.split("@", 1)[1])
+            ses.verify_email_identity(EmailAddress=SENDER_EMAIL)
+            db.connect(reuse_if_open=True)
+            for _ in range(args.rounds):
+                stages, counters, totals = run_round(server, seed, args.hours, args.budget)
+                rounds.append({"stages": stages, "counters": counters, "totals": totals})
+    finally:
+        tracemalloc.stop()
+        server.stop()
+        db.close()
+    report(rounds)
+    if args.json:
+        Path(args.json).write_text(json.dumps(rounds, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import dateutil.parser
+
+from models import db, PendingArticle, PendingDigest
+
+# Stop starting new work once less than this much Lambda time is left
+DEADLINE_MARGIN_MS = int(os.getenv("DEADLINE_MARGIN_MS", "60000"))
+# Stop extracting new articles earlier, leaving time to cluster and commit
+# the ones already extracted
+EXTRACTION_MARGIN_MS = int(os.getenv("EXTRACTION_MARGIN_MS", "120000"))
+# Articles whose extraction keeps failing are dropped after this many runs
+MAX_PENDING_ATTEMPTS = int(os.getenv("MAX_PENDING_ATTEMPTS", "3"))
+# Digests that still cannot be sent after this many days are dropped
+PENDING_DIGEST_TTL_DAYS = int(os.getenv("PENDING_DIGEST_TTL_DAYS", "3"))
+
+
+class Deadline:
+    """Tracks the time left in a Lambda invocation.
+
+    Without a context (local runs, tests) an optional `budget_ms` is used, and
+    with neither the deadline never expires.
+    """
+
+    def __init__(self, context=None, margin_ms=DEADLINE_MARGIN_MS, budget_ms=None):
+        self.context = context if hasattr(context, "get_remaining_time_in_millis") else None
+        self.margin_ms = margin_ms
+        self.end = time.monotonic() + budget_ms / 1000 if budget_ms is not None else None
+
+    def remaining_ms(self):
+        if self.context:
+            return self.context.get_remaining_time_in_millis()
+        if self.end is not None:
+            return max(0, int((self.end - time.monotonic()) * 1000))
+        return None
+
+    def expired(self, margin_ms=None):
+        remaining = self.remaining_ms()
+        return remaining is not None and remaining < (self.margin_ms if margin_ms is None else margin_ms)
+
+    def seconds_left(self):
+        """Seconds of work left before the margin, or None without a limit."""
+        remaining = self.remaining_ms()
+        return None if remaining is None else (remaining - self.margin_ms) / 1000
+
+
+def _serialize(candidate):
+    return {**candidate, "published": candidate["published"].isoformat()}
+
+
+def _deserialize(payload):
+    return {**payload, "published": dateutil.parser.parse(payload["published"])}
+
+
+def load_pending_candidates(feeds):
+    """Candidates checkpointed by earlier runs for these feeds, oldest first."""
+    urls = [feed_info.get("url") for feed_info in feeds if feed_info.get("url")]
+    if not urls:
+        return []
+    query = (
+        PendingArticle.select(PendingArticle.payload)
+        .where(PendingArticle.feed_url.in_(urls))
+        .order_by(PendingArticle.created_at)
+        .tuples()
+    )
+    candidates = [_deserialize(payload) for (payload,) in query]
+    if candidates:
+        logging.info(f"Resuming {len(candidates)} checkpointed articles")
+    return candidates
+
+
+def replace_pending_candidates(done_links, candidates):
+    """In one transaction, drop checkpoint rows for `done_links` and store
+    `candidates` (dropping ones that ran out of attempts) for the next run."""
+    candidates = [c for c in candidates if c.get("attempts", 0) < MAX_PENDING_ATTEMPTS]
+    with db.atomic():
+        if done_links:
+            PendingArticle.delete().where(PendingArticle.url.in_(list(set(done_links)))).execute()
+        if not candidates:
+            return
+        now = datetime.now(timezone.utc)
+        rows = [
+            {
+                "url": c["link"],
+                "feed_url": c["feed_url"],
+                "payload": _serialize(c),
+                "attempts": c.get("attempts", 0),
+                "created_at": now,
+            }
+            for c in candidates
+        ]
+        PendingArticle.insert_many(rows).on_conflict(
+            conflict_target=[PendingArticle.url],
+            preserve=[PendingArticle.payload, PendingArticle.attempts]
+        ).execute()
+
+
+def queue_digests(rows):
+    """Store (email, url, incident) rows for the next digest send."""
+    rows = [{"email": email, "url": url, "incident": incident} for email, url, incident in rows]
+    if rows:
+        PendingDigest.insert_many(rows).on_conflict_ignore().execute()
+
+
+def load_pending_digests():
+    """Queued digest incidents as email -> [(url, incident)], oldest first.
+    Rows past PENDING_DIGEST_TTL_DAYS are purged."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=PENDING_DIGEST_TTL_DAYS)
+    expired = PendingDigest.delete().where(PendingDigest.created_at < cutoff).execute()
+    if expired:
+        logging.warning(f"Dropped {expired} digest incidents that could not be sent")
+    digests = {}
+    query = (
+        PendingDigest.select(PendingDigest.email, PendingDigest.url, PendingDigest.incident)
+        .order_by(PendingDigest.created_at, PendingDigest.id)
+        .tuples()
+    )
+    for email, url, incident in query:
+        digests.setdefault(email, []).append((url, incident))
+    return digests
+
+
+def clear_pending_digests(emails, urls):
+    if emails and urls:
+        PendingDigest.delete().where(
+            (PendingDigest.email.in_(list(emails))) & (PendingDigest.url.in_(list(urls)))
+        ).execute()
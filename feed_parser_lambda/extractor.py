@@ -0,0 +1,184 @@
+import re
+import codecs
+from html.parser import HTMLParser
+
+# Elements whose text is never article content
+SKIP_TAGS = frozenset(["script", "style", "noscript", "template", "svg"])
+# Block elements that group paragraphs; scores are credited to these
+CONTAINER_TAGS = frozenset(["body", "main", "article", "section", "div", "aside", "nav", "header", "footer", "form", "ul", "ol", "li", "blockquote", "td"])
+# Paragraphs inside these are page chrome, not article content
+BOILERPLATE_TAGS = frozenset(["aside", "nav", "header", "footer", "form"])
+# Page-level containers are never flagged by their class or id
+UNFLAGGED_TAGS = frozenset(["body", "main", "article"])
+VOID_TAGS = frozenset(["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"])
+# Matched against whole words of class/id/role values ("share-buttons", not "tag-sharepoint")
+BOILERPLATE_ATTR_RE = re.compile(
+    r"(comment|cookie|consent|newsletter|subscribe|signup|related|share|social|sidebar|footer|promo|advert|banner|popup|modal)s?",
+    re.I,
+)
+# WordPress taxonomy classes name the post's tags, not the container's role
+TAXONOMY_CLASS_PREFIXES = ("tag-", "category-")
+BOILERPLATE_TEXT_RE = re.compile(
+    r"cookie|newsletter|subscribe|sign up|all rights reserved|privacy policy|terms of (use|service)|follow us|leave a comment|share this",
+    re.I,
+)
+# Boilerplate text patterns only disqualify paragraphs shorter than this
+BOILERPLATE_TEXT_MAX_CHARS = 250
+MAX_LINK_DENSITY = 0.5
+# Containers that say they hold the article get their score boosted
+CONTENT_TAG_BOOST = {"article": 1.5, "main": 1.25}
+
+
+class Paragraph:
+    __slots__ = ("text", "link_chars", "ancestors", "boilerplate")
+
+    def __init__(self, text, link_chars, ancestors, boilerplate):
+        self.text = text
+        self.link_chars = link_chars
+        self.ancestors = ancestors
+        self.boilerplate = boilerplate
+
+
+class ParagraphExtractor(HTMLParser):
+    """Incremental parser that collects the text of <p> elements.
+
+    Fed chunk by chunk, it only keeps paragraph text plus the chain of
+    enclosing containers and never builds a DOM.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        # container id -> tag name
+        self.containers = {0: "body"}
+        self._stack = [(0, "body", False)]
+        self._current = None
+        self._link_chars = 0
+        self._link_depth = 0
+        self._skip_depth = 0
+
+    def _flush(self):
+        if self._current is not None:
+            text = " ".join("".join(self._current).split())
+            if text:
+                ancestors = tuple(container_id for container_id, _, _ in reversed(self._stack))
+                boilerplate = any(flagged for _, _, flagged in self._stack)
+                self.paragraphs.append(Paragraph(text, self._link_chars, ancestors, boilerplate))
+        self._current = None
+        self._link_chars = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "p":
+            self._flush()
+            self._current = []
+        elif tag == "br" and self._current is not None:
+            self._current.append(" ")
+        elif tag == "a":
+            self._link_depth += 1
+        elif tag in CONTAINER_TAGS:
+            flagged = tag in BOILERPLATE_TAGS or (tag not in UNFLAGGED_TAGS and is_boilerplate_attrs(attrs))
+            container_id = len(self.containers)
+            self.containers[container_id] = tag
+            self._stack.append((container_id, tag, flagged))
+
+    def handle_startendtag(self, tag, attrs):
+        # A self-closed container (<div/>) opens and closes nothing
+        if tag in VOID_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "p":
+            self._flush()
+        elif tag == "a":
+            self._link_depth = max(0, self._link_depth - 1)
+        elif tag in CONTAINER_TAGS:
+            # Close the innermost matching container along with anything left unclosed inside it
+            for i in range(len(self._stack) - 1, 0, -1):
+                if self._stack[i][1] == tag:
+                    self._flush()
+                    del self._stack[i:]
+                    break
+
+    def handle_data(self, data):
+        if self._current is not None and not self._skip_depth:
+            self._current.append(data)
+            if self._link_depth:
+                self._link_chars += len(data.strip())
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def is_boilerplate_attrs(attrs):
+    for name, value in attrs:
+        if name not in ("id", "class", "role") or not value:
+            continue
+        for token in value.lower().split():
+            if token.startswith(TAXONOMY_CLASS_PREFIXES):
+                continue
+            if any(BOILERPLATE_ATTR_RE.fullmatch(word) for word in re.split(r"[-_]", token)):
+                return True
+    return False
+
+
+def parse_paragraphs(chunks, encoding="utf-8", max_bytes=None):
+    """Feed byte `chunks` through a ParagraphExtractor, stopping after
+    `max_bytes`, and return the finished parser."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    parser = ParagraphExtractor()
+    read = 0
+    for chunk in chunks:
+        if max_bytes is not None and read + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - read]
+        read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if max_bytes is not None and read >= max_bytes:
+            break
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    return parser
+
+
+def is_content_paragraph(paragraph):
+    return not paragraph.boilerplate and is_content_text(paragraph)
+
+
+def is_content_text(paragraph):
+    """Text-only checks: not mostly links and not a short boilerplate line."""
+    if paragraph.link_chars > MAX_LINK_DENSITY * len(paragraph.text):
+        return False
+    if len(paragraph.text) < BOILERPLATE_TEXT_MAX_CHARS and BOILERPLATE_TEXT_RE.search(paragraph.text):
+        return False
+    return True
+
+
+def select_main_content(parser):
+    """Pick the container with the highest density of paragraph text.
+
+    Each content paragraph credits its non-link text length to its parent
+    container in full and to the grandparent at half weight; the paragraphs
+    under the best scoring container are returned in document order.
+    """
+    candidates = [p for p in parser.paragraphs if is_content_paragraph(p)]
+    if not candidates:
+        return []
+    scores = {}
+    for paragraph in candidates:
+        score = len(paragraph.text) - paragraph.link_chars
+        for depth, container_id in enumerate(paragraph.ancestors[:2]):
+            scores[container_id] = scores.get(container_id, 0) + score / (depth + 1)
+    best = max(scores, key=lambda c: scores[c] * CONTENT_TAG_BOOST.get(parser.containers[c], 1))
+    return [p.text for p in candidates if best in p.ancestors]
+
+
+def extract_main_text(chunks, encoding="utf-8", max_bytes=None):
+    """Main article paragraphs of the page, falling back to every paragraph
+    that passes the text checks when no container qualifies."""
+    parser = parse_paragraphs(chunks, encoding, max_bytes)
+    main = select_main_content(parser)
+    return main or [p.text for p in parser.paragraphs if is_content_text(p)]
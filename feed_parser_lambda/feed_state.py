@@ -0,0 +1,135 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from peewee import fn
+
+from models import FeedCache, FeedCursor, RejectedArticle, ExtractionCache, IncidentSignature
+
+REJECTED_URL_TTL_DAYS = int(os.getenv("REJECTED_URL_TTL_DAYS", "30"))
+EXTRACTION_CACHE_TTL_DAYS = int(os.getenv("EXTRACTION_CACHE_TTL_DAYS", "14"))
+
+
+def as_utc(value):
+    # Postgres `timestamp` columns come back naive; everything here is stored as UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _feed_urls(feeds):
+    return [feed_info.get("url") for feed_info in feeds if feed_info.get("url")]
+
+
+def load_feed_validators(feeds):
+    urls = _feed_urls(feeds)
+    if not urls:
+        return {}
+    query = FeedCache.select().where(FeedCache.url.in_(urls))
+    return {row.url: (row.etag, row.last_modified) for row in query}
+
+
+def save_feed_validators(validators):
+    rows = [
+        {"url": url, "etag": etag, "last_modified": last_modified, "updated_at": datetime.now(timezone.utc)}
+        for url, (etag, last_modified) in validators.items()
+        if etag or last_modified
+    ]
+    if not rows:
+        return
+    FeedCache.insert_many(rows).on_conflict(
+        conflict_target=[FeedCache.url],
+        preserve=[FeedCache.etag, FeedCache.last_modified, FeedCache.updated_at]
+    ).execute()
+
+
+def load_feed_cursors(feeds):
+    urls = _feed_urls(feeds)
+    if not urls:
+        return {}
+    query = FeedCursor.select().where(FeedCursor.url.in_(urls))
+    return {row.url: (as_utc(row.last_published), row.last_guid) for row in query}
+
+
+def save_feed_cursors(cursors):
+    rows = [
+        {
+            "url": url,
+            "last_published": last_published.astimezone(timezone.utc).replace(tzinfo=None),
+            "last_guid": last_guid,
+            "updated_at": datetime.now(timezone.utc),
+        }
+        for url, (last_published, last_guid) in cursors.items()
+    ]
+    if not rows:
+        return
+    FeedCursor.insert_many(rows).on_conflict(
+        conflict_target=[FeedCursor.url],
+        preserve=[FeedCursor.last_published, FeedCursor.last_guid, FeedCursor.updated_at]
+    ).execute()
+
+
+def find_rejected_urls(urls):
+    """Return the subset of `urls` with an unexpired rejection, in one query."""
+    urls = list(set(urls))
+    if not urls:
+        return set()
+    query = RejectedArticle.select(RejectedArticle.url).where(
+        (RejectedArticle.url == fn.ANY(urls)) &
+        (RejectedArticle.expires_at > datetime.now(timezone.utc))
+    )
+    return {url for (url,) in query.tuples()}
+
+
+def save_rejected_urls(rejections, ttl_days=REJECTED_URL_TTL_DAYS):
+    """Record `rejections` (url -> reason) and purge expired rows."""
+    now = datetime.now(timezone.utc)
+    RejectedArticle.delete().where(RejectedArticle.expires_at <= now).execute()
+    rows = [
+        {"url": url, "reason": reason, "rejected_at": now, "expires_at": now + timedelta(days=ttl_days)}
+        for url, reason in rejections.items()
+    ]
+    if not rows:
+        return
+    RejectedArticle.insert_many(rows).on_conflict(
+        conflict_target=[RejectedArticle.url],
+        preserve=[RejectedArticle.reason, RejectedArticle.rejected_at, RejectedArticle.expires_at]
+    ).execute()
+
+
+def load_cached_extractions(keys):
+    """Return key -> extraction result for unexpired cache entries, in one query."""
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    query = ExtractionCache.select(ExtractionCache.key, ExtractionCache.result).where(
+        (ExtractionCache.key == fn.ANY(keys)) &
+        (ExtractionCache.expires_at > datetime.now(timezone.utc))
+    )
+    return {key: result for key, result in query.tuples()}
+
+
+def save_cached_extractions(results, ttl_days=EXTRACTION_CACHE_TTL_DAYS):
+    """Store `results` (key -> extraction result) and purge expired rows."""
+    now = datetime.now(timezone.utc)
+    ExtractionCache.delete().where(ExtractionCache.expires_at <= now).execute()
+    rows = [
+        {"key": key, "result": result, "created_at": now, "expires_at": now + timedelta(days=ttl_days)}
+        for key, result in results.items()
+    ]
+    if not rows:
+        return
+    ExtractionCache.insert_many(rows).on_conflict(
+        conflict_target=[ExtractionCache.key],
+        preserve=[ExtractionCache.result, ExtractionCache.created_at, ExtractionCache.expires_at]
+    ).execute()
+
+
+def save_incident_signatures(signatures):
+    """Store `signatures` (rss_feeds id -> simhash)."""
+    rows = [{"feed": feed_id, "signature": signature} for feed_id, signature in signatures.items()]
+    if not rows:
+        return
+    IncidentSignature.insert_many(rows).on_conflict(
+        conflict_target=[IncidentSignature.feed],
+        preserve=[IncidentSignature.signature]
+    ).execute()
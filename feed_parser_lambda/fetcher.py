@@ -0,0 +1,181 @@
+import os
+import codecs
+import logging
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import requests
+from requests.adapters import HTTPAdapter
+import feedparser
+
+from extractor import extract_main_text
+from tokens import fit_paragraphs
+from politeness import HostScheduler, parse_retry_after, HOST_THROTTLE_BACKOFF, MAX_RETRY_AFTER
+
+USER_AGENT = "Chrome/58.0.3029.110 Safari/537.3"
+FEED_FETCH_WORKERS = int(os.getenv("FEED_FETCH_WORKERS", "8"))
+FEED_FETCH_TIMEOUT = float(os.getenv("FEED_FETCH_TIMEOUT", "20"))
+ARTICLE_FETCH_WORKERS = int(os.getenv("ARTICLE_FETCH_WORKERS", "8"))
+ARTICLE_FETCH_TIMEOUT = float(os.getenv("ARTICLE_FETCH_TIMEOUT", "10"))
+# Article pages are read incrementally and cut off after this many bytes
+ARTICLE_MAX_BYTES = int(os.getenv("ARTICLE_MAX_BYTES", str(2 * 1024 * 1024)))
+ARTICLE_CHUNK_SIZE = 64 * 1024
+# Article text handed to the LLM is trimmed to this many tokens
+ARTICLE_MAX_TOKENS = int(os.getenv("ARTICLE_MAX_TOKENS", "1500"))
+# A throttled request is retried once when the host asks us to wait at most MAX_RETRY_AFTER
+THROTTLE_RETRIES = int(os.getenv("THROTTLE_RETRIES", "1"))
+THROTTLE_STATUS_CODES = frozenset([429, 503])
+
+_session = None
+_scheduler = HostScheduler()
+
+
+def get_session():
+    """Module-wide keep-alive session, reused across warm Lambda invocations."""
+    global _session
+    if _session is None:
+        pool_size = max(FEED_FETCH_WORKERS, ARTICLE_FETCH_WORKERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session = requests.Session()
+        session.headers.update({"User-Agent": USER_AGENT})
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+
+@contextmanager
+def polite_get(url, **kwargs):
+    """GET `url` through the per-host scheduler, yielding the response.
+
+    The host slot is held until the block exits so streamed bodies count
+    against the host's concurrency. A 429/503 pushes back every request to
+    that host by its Retry-After and is retried when the wait is short.
+    Raises HostBusy rather than waiting on a backed-off host for longer than
+    the request timeout.
+    """
+    max_wait = kwargs.get("timeout")
+    for attempt in range(THROTTLE_RETRIES + 1):
+        with _scheduler.slot(url, max_wait=max_wait):
+            response = get_session().get(url, **kwargs)
+            if response.status_code not in THROTTLE_STATUS_CODES:
+                with response:
+                    yield response
+                return
+            delay = parse_retry_after(response.headers.get("Retry-After"))
+            _scheduler.defer(url, HOST_THROTTLE_BACKOFF if delay is None else delay)
+            if delay is None or delay > MAX_RETRY_AFTER or attempt == THROTTLE_RETRIES:
+                with response:
+                    yield response
+                return
+            logging.info(f"Throttled by host, retrying in {delay:.0f}s: {url}")
+            response.close()
+            # The retry may wait out the Retry-After the host asked for
+            max_wait = max(max_wait or 0, delay + 1)
+
+
+def fetch_feed(url, timeout=FEED_FETCH_TIMEOUT, etag=None, last_modified=None):
+    """Conditional GET of a feed.
+
+    Returns (feed, etag, last_modified); feed is None when the server answers
+    304 Not Modified.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with polite_get(url, timeout=timeout, headers=headers) as response:
+        if response.status_code == 304:
+            return None, etag, last_modified
+        response.raise_for_status()
+        return (
+            feedparser.parse(response.content),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+
+def fetch_feeds(feeds, max_workers=FEED_FETCH_WORKERS, timeout=FEED_FETCH_TIMEOUT, validators=None):
+    """Download and parse all feeds concurrently.
+
+    Returns a list of (feed_info, entries) in the same order as `feeds`. A feed
+    that errors or does not finish within `timeout` seconds yields no entries.
+    `validators` maps feed url -> (etag, last_modified); it is sent with each
+    request and updated in place from the responses.
+    """
+    if validators is None:
+        validators = {}
+    feeds = [feed_info for feed_info in feeds if feed_info.get("url")]
+    if not feeds:
+        return []
+    results = []
+    workers = max(1, min(max_workers, len(feeds)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            executor.submit(fetch_feed, feed_info["url"], timeout, *validators.get(feed_info["url"], (None, None)))
+            for feed_info in feeds
+        ]
+        # Feeds queued behind a full pool get their own timeout slot
+        rounds = -(-len(feeds) // workers)
+        deadline = time.monotonic() + timeout * rounds
+        for feed_info, future in zip(feeds, futures):
+            url = feed_info["url"]
+            try:
+                feed, etag, last_modified = future.result(timeout=max(0, deadline - time.monotonic()))
+                if feed is None:
+                    logging.info(f"Feed not modified: {url}")
+                    entries = []
+                else:
+                    entries = list(feed.entries)
+                validators[url] = (etag, last_modified)
+            except FutureTimeoutError:
+                logging.warning(f"Timed out fetching feed: {url}")
+                entries = []
+            except Exception as e:
+                logging.warning(f"Failed to fetch feed: {url}, error: {e}")
+                entries = []
+            results.append((feed_info, entries))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def response_encoding(response):
+    # requests falls back to ISO-8859-1 for text/* without a charset; most pages are utf-8
+    if "charset" in response.headers.get("Content-Type", "").lower() and response.encoding:
+        return response.encoding
+    return "utf-8"
+
+
+def fetch_article_text(url, timeout=ARTICLE_FETCH_TIMEOUT, max_bytes=ARTICLE_MAX_BYTES, max_tokens=ARTICLE_MAX_TOKENS):
+    try:
+        logging.info(f"Fetching article text from: {url}")
+        with polite_get(url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            try:
+                encoding = codecs.lookup(response_encoding(response)).name
+            except LookupError:
+                encoding = "utf-8"
+            paragraphs = extract_main_text(
+                response.iter_content(chunk_size=ARTICLE_CHUNK_SIZE), encoding=encoding, max_bytes=max_bytes
+            )
+        return fit_paragraphs(paragraphs, max_tokens)
+    except Exception as e:
+        logging.warning(f"Failed to fetch article: {url}, error: {e}")
+        return ""
+
+
+def fetch_articles(urls, max_workers=ARTICLE_FETCH_WORKERS):
+    """Fetch article bodies concurrently; returns texts in the order of `urls`."""
+    urls = list(urls)
+    if not urls:
+        return []
+    texts = [""] * len(urls)
+    order = _scheduler.interleave(urls)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+        for i, text in zip(order, executor.map(fetch_article_text, [urls[i] for i in order])):
+            texts[i] = text
+    return texts
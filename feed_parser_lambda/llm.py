@@ -0,0 +1,140 @@
+import os
+import time
+import random
+import logging
+import threading
+
+import requests
+
+from politeness import parse_retry_after
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# Exponential backoff base and cap in seconds; each wait is drawn uniformly below the bound
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Consecutive failed calls that open the breaker, and how long it stays open
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "120"))
+
+RETRY_STATUS_CODES = frozenset([408, 409, 429, 500, 502, 503, 504])
+
+
+class CircuitBreaker:
+    """Stops calls to a failing service for `cooldown` seconds after
+    `threshold` consecutive failures, then lets a single trial call through."""
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        with self._lock:
+            return self.opened_at is not None and (
+                self._trial or time.monotonic() - self.opened_at < self.cooldown
+            )
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                logging.warning(f"LLM circuit breaker open after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+
+_session = None
+_breaker = CircuitBreaker()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def llm_available():
+    """False while the breaker is open; callers should defer their work."""
+    return not _breaker.is_open()
+
+
+def backoff_delay(attempt, retry_after=None):
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+def post_json(url, headers, payload, max_retries=LLM_MAX_RETRIES, breaker=_breaker, deadline=None):
+    """POST `payload` and return the decoded JSON response, or None.
+
+    Timeouts, connection errors, 429 and 5xx responses are retried with
+    jittered exponential backoff, honouring Retry-After. A call that still
+    fails counts against the circuit breaker; while it is open this returns
+    None straight away. With a `deadline` (see checkpoint.Deadline) the read
+    timeout is shortened and retries stop so the call ends before it.
+    """
+    seconds_left = deadline.seconds_left if deadline else lambda: None
+    left = seconds_left()
+    if left is not None and left <= LLM_CONNECT_TIMEOUT:
+        logging.warning("Not enough time left for an LLM request")
+        return None
+    if not breaker.allow():
+        return None
+    error = None
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        left = seconds_left()
+        read_timeout = LLM_READ_TIMEOUT if left is None else min(LLM_READ_TIMEOUT, left - LLM_CONNECT_TIMEOUT)
+        if read_timeout <= 0:
+            logging.error(f"LLM request out of time after {attempt} attempts: {error}")
+            break
+        try:
+            response = get_session().post(
+                url, headers=headers, json=payload, timeout=(LLM_CONNECT_TIMEOUT, read_timeout)
+            )
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                breaker.record_success()
+                return response.json()
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            error = f"HTTP {response.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        except Exception as e:
+            # Client errors and undecodable bodies will not get better on retry,
+            # but the service did answer so they do not trip the breaker
+            logging.error(f"LLM request failed: {e}")
+            breaker.record_success()
+            return None
+        if attempt == max_retries or (retry_after or 0) > LLM_BACKOFF_MAX:
+            logging.error(f"LLM request failed after {attempt + 1} attempts: {error}")
+            break
+        delay = backoff_delay(attempt, retry_after)
+        left = seconds_left()
+        if left is not None and delay + LLM_CONNECT_TIMEOUT >= left:
+            logging.error(f"LLM request failed with no time left to retry: {error}")
+            break
+        logging.warning(f"LLM request failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+    breaker.record_failure()
+    return None
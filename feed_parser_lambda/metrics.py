@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "VendexLabs/FeedParser")
+FUNCTION_NAME = os.getenv("AWS_LAMBDA_FUNCTION_NAME", "rss_feed_parser")
+
+
+class RunMetrics:
+    """Stage timings and counters for one invocation, written out as a single
+    CloudWatch Embedded Metric Format (EMF) log line.
+
+    Timers accumulate, so a stage that runs once per chunk or per feed worker
+    reports its total time across the invocation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.counters = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.timings[stage] = self.timings.get(stage, 0) + elapsed_ms
+
+    def to_emf(self, **dimensions):
+        dimensions = {"FunctionName": FUNCTION_NAME, **{k: str(v) for k, v in dimensions.items()}}
+        with self._lock:
+            timings = {f"{stage}Time": round(ms, 1) for stage, ms in self.timings.items()}
+            counters = dict(self.counters)
+        units = {**{name: "Milliseconds" for name in timings}, **{name: "Count" for name in counters}}
+        values = {**timings, **counters}
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": units[name]} for name in values],
+                }],
+            },
+            **dimensions,
+            **values,
+        }
+
+    def emit(self, **dimensions):
+        # Written straight to stdout: the logging handler's prefix would stop
+        # CloudWatch from recognising the line as EMF
+        print(json.dumps(self.to_emf(**dimensions)), flush=True)
+
+
+metrics = RunMetrics()
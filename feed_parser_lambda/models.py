@@ -1,5 +1,8 @@
 import os
+from datetime import datetime, timezone
+
 import peewee
+from playhouse.postgres_ext import JSONField
 
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT", "5432")
@@ -42,6 +45,83 @@ class RSSFeed(BaseModel):
         table_name = 'rss_feeds'
 
 
+class FeedCache(BaseModel):
+    """HTTP validators from the last successful fetch of each feed url"""
+    url = peewee.TextField(unique=True)
+    etag = peewee.TextField(null=True)
+    last_modified = peewee.TextField(null=True)
+    updated_at = peewee.DateTimeField(default=lambda: datetime.now(timezone.utc))
+
+    class Meta:
+        table_name = 'feed_cache'
+
+
+class FeedCursor(BaseModel):
+    """Newest entry (published timestamp + guid) already processed for each feed url"""
+    url = peewee.TextField(unique=True)
+    last_published = peewee.DateTimeField()
+    last_guid = peewee.TextField(null=True)
+    updated_at = peewee.DateTimeField(default=lambda: datetime.now(timezone.utc))
+
+    class Meta:
+        table_name = 'feed_cursors'
+
+
+class RejectedArticle(BaseModel):
+    """Articles already classified as not relevant, skipped until expires_at"""
+    url = peewee.TextField(unique=True)
+    reason = peewee.TextField()
+    rejected_at = peewee.DateTimeField(default=lambda: datetime.now(timezone.utc))
+    expires_at = peewee.DateTimeField(index=True)
+
+    class Meta:
+        table_name = 'rejected_articles'
+
+
+class ExtractionCache(BaseModel):
+    """LLM extraction results keyed by hash of normalized article text + prompt version"""
+    key = peewee.CharField(max_length=64, unique=True)
+    result = JSONField()
+    created_at = peewee.DateTimeField(default=lambda: datetime.now(timezone.utc))
+    expires_at = peewee.DateTimeField(index=True)
+
+    class Meta:
+        table_name = 'extraction_cache'
+
+
+class IncidentSignature(BaseModel):
+    """SimHash of title + summary for each rss_feeds row, used for local dedupe"""
+    feed = peewee.ForeignKeyField(RSSFeed, unique=True, on_delete='CASCADE', column_name='rss_feed_id')
+    signature = peewee.BigIntegerField()
+
+    class Meta:
+        table_name = 'rss_feed_signatures'
+
+
+class PendingArticle(BaseModel):
+    """Feed entries checkpointed for the next run (deadline reached or extraction deferred)"""
+    url = peewee.TextField(unique=True)
+    feed_url = peewee.TextField(index=True)
+    payload = JSONField()
+    attempts = peewee.IntegerField(default=0)
+    created_at = peewee.DateTimeField(default=lambda: datetime.now(timezone.utc))
+
+    class Meta:
+        table_name = 'pending_articles'
+
+
+class PendingDigest(BaseModel):
+    """Incidents waiting to go out in a subscriber's next digest email"""
+    email = peewee.TextField()
+    url = peewee.TextField()
+    incident = JSONField()
+    created_at = peewee.DateTimeField(default=lambda: datetime.now(timezone.utc))
+
+    class Meta:
+        table_name = 'pending_digests'
+        indexes = ((('email', 'url'), True),)
+
+
 # --- Vendor List Models for Subscriber System ---
 import uuid
 
@@ -63,6 +143,18 @@ class Subscriber(BaseModel):
     class Meta:
         table_name = 'subscribers'
 
+class SubscriberPreference(BaseModel):
+    """Notification delivery preference; subscribers without a row get immediate emails"""
+    subscriber = peewee.ForeignKeyField(Subscriber, primary_key=True, backref='preference', on_delete='CASCADE')
+    delivery_mode = peewee.CharField(
+        max_length=10,
+        choices=[('immediate', 'Immediate'), ('digest', 'Digest')],
+        default='immediate'
+    )
+
+    class Meta:
+        table_name = 'subscriber_preferences'
+
 class Vendor(BaseModel):
     id = peewee.UUIDField(primary_key=True, default=uuid.uuid4)
     name = peewee.TextField(unique=True)
@@ -70,6 +162,15 @@ class Vendor(BaseModel):
     class Meta:
         table_name = 'vendors'
 
+class VendorProfile(BaseModel):
+    """Vendor info maintained by the vendor info lambda; only the name and aliases are read here"""
+    id = peewee.UUIDField(primary_key=True, default=uuid.uuid4)
+    vendor = peewee.TextField(unique=True)
+    alias = JSONField(null=True)
+
+    class Meta:
+        table_name = 'vendor_profiles'
+
 class VendorList(BaseModel):
     id = peewee.UUIDField(primary_key=True, default=uuid.uuid4)
     name = peewee.TextField()
@@ -1,58 +1,89 @@
 import os
 import json
+import hashlib
 from datetime import datetime, timedelta, timezone
 import logging
 
-import requests
-import feedparser
 import dateutil.parser
-from bs4 import BeautifulSoup
-from cleanco import basename
 import peewee
+from peewee import fn
 
-from sender import send_email_ses
-from models import db, RSSFeed, Vendor, VendorList, VendorListVendor, Subscriber, VendorListSubscriber
+from sender import send_bulk_email_ses, send_digest_email_ses, incident_template_data
+from fetcher import fetch_feeds, fetch_articles
+from tokens import count_tokens
+from llm import post_json, llm_available
+from metrics import metrics
+from vendors import canonical_vendor, get_vendor_index, reset_vendor_index
+from queues import LocalQueue, SQSQueue, is_sqs_event
+from checkpoint import (
+    Deadline, EXTRACTION_MARGIN_MS, load_pending_candidates, replace_pending_candidates,
+    queue_digests, load_pending_digests, clear_pending_digests
+)
+from feed_state import (
+    load_feed_validators, save_feed_validators, load_feed_cursors, save_feed_cursors,
+    find_rejected_urls, save_rejected_urls, load_cached_extractions, save_cached_extractions,
+    save_incident_signatures, as_utc
+)
+from similarity import incident_signature, hamming_distance, classify, DUPE, AMBIGUOUS
+from models import db, RSSFeed, FeedCache, FeedCursor, RejectedArticle, ExtractionCache, IncidentSignature, SubscriberPreference, PendingArticle, PendingDigest, Vendor, VendorList, VendorListVendor, Subscriber, VendorListSubscriber
 
 API_URL = "https://api.openai.com/v1/chat/completions"
 API_KEY = os.getenv("API_KEY")
+OPENAI_MODEL = "gpt-4o-mini"
 RSS_FEED_URLS = os.getenv("RSS_FEED_URLS", "[]")
 FEEDS = json.loads(RSS_FEED_URLS)
+# When set, scheduled runs enqueue one job per feed here for worker invocations
+FEED_QUEUE_URL = os.getenv("FEED_QUEUE_URL")
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", "4"))
+# Articles are extracted, deduped and committed in chunks of this size
+PIPELINE_CHUNK_SIZE = int(os.getenv("PIPELINE_CHUNK_SIZE", "12"))
+# First key of the advisory locks that serialize dedupe and insert per vendor
+VENDOR_LOCK_CLASS = 4201
+# Seconds to wait for vendor locks once the deadline margin has been reached
+VENDOR_LOCK_MIN_WAIT = float(os.getenv("VENDOR_LOCK_MIN_WAIT", "5"))
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger().setLevel(logging.INFO)
 
-def call_openai_api(messages, max_tokens=1000, temperature=0):
+def call_openai_api(messages, max_tokens=1000, temperature=0, deadline=None):
     headers = {"Authorization": f"Bearer {API_KEY}"}
     data = {
-        "model": "gpt-4o-mini",
+        "model": OPENAI_MODEL,
         "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature
     }
+    metrics.incr("LLMCalls")
+    response_json = post_json(API_URL, headers, data, deadline=deadline)
+    if response_json is None:
+        metrics.incr("LLMFailures")
+        return None
+    usage = response_json.get("usage") or {}
+    metrics.incr("LLMPromptTokens", usage.get("prompt_tokens", 0))
+    metrics.incr("LLMCompletionTokens", usage.get("completion_tokens", 0))
     try:
-        response = requests.post(API_URL, headers=headers, json=data)
-        response.raise_for_status()
-        response_json = response.json()
         return response_json["choices"][0]["message"]["content"]
     except Exception as e:
         logging.error(f"OpenAI API call failed: {e}")
         return None
 
-def is_dupe(results, entry):
+def is_dupe(results, entry, deadline=None):
+    """True or False, or None when the LLM could not be asked."""
     prompt = f"""Article: {entry[0]}.
     Is the given article a duplicate of the following articles?
     {results}.
     Answer with only "YES" or "NO".
     """
     messages = [{"role": "user", "content": prompt}]
-    response_text = call_openai_api(messages)
-    if response_text and "YES" in response_text.upper():
+    response_text = call_openai_api(messages, deadline=deadline)
+    if response_text is None:
+        return None
+    if "YES" in response_text.upper():
         logging.info(f"Duplicate found: {entry[0]}")
         return True
     return False
 
-def query_AI_extraction(summary):
-    prompt = f"""Article: {summary}. 
+EXTRACTION_PROMPT = """Article: {summary}. 
     If the article is not about a security incident, return nothing.
     If it is, answer the following:
     Based on the Article, What compromised entity is mentioned in the summary?
@@ -64,157 +95,720 @@ def query_AI_extraction(summary):
     Potentially Impacted Data: [Specify the type of data, e.g., customer information, login credentials, etc.]
     Status: The incident is under active investigation, with immediate steps underway to mitigate potential impact.
     """
-    system_prompt = (
-        'You are a JSON only responder. If the article is not about a security incident, return nothing (empty response). '
-        'Otherwise, respond with a format like this, if not certain about a field give None: '
-        '{"vendor": "vendorName", "product": "productName", "exploits": "", "summary":"summary", '
-        '"incident_type": "", '
-        '"affected_service": "", '
-        '"potentially_impacted_data": "[Specify the type of data, e.g., customer information, login credentials, etc.]", '
-        '"status": "Status of Event"} '
-        'Do not say anything else in the response. Do not include explanations, apologies, or any text outside of the JSON block. '
-        'If unsure, still answer in the same format but with null objects.'
-    )
+EXTRACTION_SYSTEM_PROMPT = (
+    'You are a JSON only responder. If the article is not about a security incident, return nothing (empty response). '
+    'Otherwise, respond with a format like this, if not certain about a field give None: '
+    '{"vendor": "vendorName", "product": "productName", "exploits": "", "summary":"summary", '
+    '"incident_type": "", '
+    '"affected_service": "", '
+    '"potentially_impacted_data": "[Specify the type of data, e.g., customer information, login credentials, etc.]", '
+    '"status": "Status of Event"} '
+    'Do not say anything else in the response. Do not include explanations, apologies, or any text outside of the JSON block. '
+    'If unsure, still answer in the same format but with null objects.'
+)
+EXTRACTION_BATCH_PROMPT = """Below are {count} articles, each introduced by a line "### Article <index>".
+    For every article, decide whether it is about a security incident and, if it is, extract the same
+    fields you would for a single article: compromised entity (vendor), affected product, how much it
+    has been exploited, a 100 word summary, incident type, affected service, potentially impacted data
+    and status.
+
+    {articles}
+    """
+EXTRACTION_BATCH_SYSTEM_PROMPT = (
+    'You are a JSON only responder. Respond with a JSON array containing exactly one object per article, like: '
+    '[{"index": 0, "result": {"vendor": "vendorName", "product": "productName", "exploits": "", "summary":"summary", '
+    '"incident_type": "", "affected_service": "", '
+    '"potentially_impacted_data": "[Specify the type of data, e.g., customer information, login credentials, etc.]", '
+    '"status": "Status of Event"}}, {"index": 1, "result": null}]. '
+    'Use "result": null for an article that is not about a security incident. '
+    'If not certain about a field give null. '
+    'Do not say anything else in the response. Do not include explanations, apologies, or any text outside of the JSON array.'
+)
+EXTRACTION_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "6"))
+EXTRACTION_BATCH_TOKENS = int(os.getenv("EXTRACTION_BATCH_TOKENS", "12000"))
+# Any edit to the prompts or model changes the version and so invalidates cached extractions
+EXTRACTION_PROMPT_VERSION = hashlib.sha256("\0".join([
+    OPENAI_MODEL, EXTRACTION_PROMPT, EXTRACTION_SYSTEM_PROMPT,
+    EXTRACTION_BATCH_PROMPT, EXTRACTION_BATCH_SYSTEM_PROMPT
+]).encode("utf-8")).hexdigest()[:16]
+
+def strip_code_fence(text):
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return text.strip()
+
+def query_AI_extraction(summary, deadline=None):
     messages = [
-        {"role": "user", "content": prompt},
-        {"role": "system", "content": system_prompt}
+        {"role": "user", "content": EXTRACTION_PROMPT.format(summary=summary)},
+        {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT}
     ]
-    response_text = call_openai_api(messages, max_tokens=500)
-    if not response_text or not response_text.strip():
+    response_text = call_openai_api(messages, max_tokens=500, deadline=deadline)
+    if response_text is None:
         return None
+    # An empty answer is the model saying this is not a security incident
+    text = strip_code_fence(response_text)
+    if not text:
+        return {}
     try:
-        return json.loads(response_text)
+        result = json.loads(text)
     except Exception as e:
         logging.error(f"Error parsing API response: {e} + {response_text}")
         return None
+    if result is None:
+        return {}
+    if not isinstance(result, dict):
+        logging.error(f"Unexpected extraction response: {response_text}")
+        return None
+    return result
+
+def pack_extraction_batches(texts, max_size=EXTRACTION_BATCH_SIZE, max_tokens=EXTRACTION_BATCH_TOKENS):
+    """Group indexes of `texts` into batches bounded by count and estimated tokens."""
+    batches, batch, batch_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if batch and (len(batch) >= max_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
 
-def fetch_article_text(url):
+def query_AI_extraction_batch(summaries, deadline=None):
+    """Extract several articles in one request.
+
+    Returns a list aligned with `summaries` ({} for non-incidents), or None if
+    the call failed or the response does not cover every article.
+    """
+    articles = "\n\n".join(f"### Article {i}\n{summary}" for i, summary in enumerate(summaries))
+    messages = [
+        {"role": "user", "content": EXTRACTION_BATCH_PROMPT.format(count=len(summaries), articles=articles)},
+        {"role": "system", "content": EXTRACTION_BATCH_SYSTEM_PROMPT}
+    ]
+    response_text = call_openai_api(messages, max_tokens=500 * len(summaries), deadline=deadline)
+    if response_text is None:
+        return None
     try:
-        logging.info(f"Fetching article text from: {url}")
-        response = requests.get(url, timeout=10, headers={"User-Agent": "Chrome/58.0.3029.110 Safari/537.3"})
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        content = soup.find_all('p')
-        return " ".join([p.get_text() for p in content])
+        items = json.loads(strip_code_fence(response_text))
+        results = {}
+        for item in items:
+            index = int(item["index"])
+            result = item.get("result")
+            if not 0 <= index < len(summaries) or not (result is None or isinstance(result, dict)):
+                raise ValueError(f"unexpected item {item}")
+            results[index] = result or {}
+        if len(results) != len(summaries):
+            raise ValueError(f"expected {len(summaries)} results, got {len(results)}")
+        return [results[i] for i in range(len(summaries))]
     except Exception as e:
-        logging.warning(f"Failed to fetch article: {url}, error: {e}")
-        return ""
+        logging.error(f"Malformed batch extraction response: {e} + {response_text}")
+        return None
+
+def run_extractions(texts, deadline=None):
+    """Extract `texts` in token-budgeted batches, falling back to one call per
+    article for any batch that fails. Results line up with `texts`."""
+    results = [None] * len(texts)
+    batches = pack_extraction_batches(texts)
+    for n, batch in enumerate(batches):
+        # Left as None so the articles are deferred to a later run
+        if not llm_available() or (deadline and deadline.expired()):
+            logging.warning(f"LLM unavailable or out of time, deferring {sum(len(b) for b in batches[n:])} articles")
+            break
+        batch_results = None
+        if len(batch) > 1:
+            batch_results = query_AI_extraction_batch([texts[i] for i in batch], deadline)
+            if batch_results is None:
+                logging.info(f"Falling back to per-article extraction for {len(batch)} articles")
+        if batch_results is None:
+            batch_results = [query_AI_extraction(texts[i], deadline) if llm_available() else None for i in batch]
+        for i, res in zip(batch, batch_results):
+            results[i] = res
+    return results
+
+def extraction_cache_key(article_text):
+    normalized = " ".join(article_text.lower().split())
+    return hashlib.sha256(f"{EXTRACTION_PROMPT_VERSION}:{normalized}".encode("utf-8")).hexdigest()
+
+def extract_articles(article_texts, deadline=None):
+    """Extract `article_texts`, reusing cached results.
+
+    Results line up with `article_texts`. Identical texts are only sent once,
+    and only well-formed results (dicts) are cached or reused.
+    """
+    keys = [extraction_cache_key(text) if text else None for text in article_texts]
+    cached = {
+        key: res
+        for key, res in load_cached_extractions(key for key in keys if key).items()
+        if isinstance(res, dict)
+    }
+    if cached:
+        logging.info(f"Extraction cache hits: {len(cached)}")
+    pending = {}
+    for key, text in zip(keys, article_texts):
+        if key and key not in cached and key not in pending:
+            pending[key] = text
+    fresh = {
+        key: res
+        for key, res in zip(pending, run_extractions(list(pending.values()), deadline))
+        if isinstance(res, dict)
+    }
+    save_cached_extractions(fresh)
+    found = {**cached, **fresh}
+    return [found.get(key) if key else None for key in keys]
+
+def entry_guid(entry):
+    return entry.get('id') or entry.get('link')
+
+def select_new_entries(entries, last_published, cursor=None):
+    """Leading entries newer than the source cursor, or than last_published when there is none."""
+    candidates = []
+    for entry in entries:
+        entry_published = dateutil.parser.parse(entry.published) if hasattr(entry, 'published') else None
+        if not entry_published:
+            break
+        published_utc = as_utc(entry_published)
+        if cursor:
+            cursor_published, cursor_guid = cursor
+            if entry_guid(entry) == cursor_guid or published_utc < cursor_published:
+                break
+        elif published_utc <= last_published:
+            break
+        candidates.append((entry, entry_published))
+    return candidates
+
+def find_existing_urls(urls):
+    """Return the subset of `urls` already stored in rss_feeds, in one query."""
+    urls = list(set(urls))
+    if not urls:
+        return set()
+    query = RSSFeed.select(RSSFeed.url).where(RSSFeed.url == fn.ANY(urls))
+    return {url for (url,) in query.tuples()}
+
+def make_candidate(feed_info, entry, entry_published):
+    return {
+        "source": feed_info.get("source", "Unknown"),
+        "feed_url": feed_info["url"],
+        "link": entry.link,
+        "title": entry.title,
+        "published": entry_published,
+        "img": entry.enclosures[0]['url'] if entry.get('enclosures') else None,
+        "attempts": 0,
+    }
+
+def build_entry(candidate, res):
+    vendor = canonical_vendor(res.get('vendor'))
+    product = res.get('product', 'Unknown')
+    exploits = res.get('exploits', 'None')
+    summary = res.get('summary', 'None')
+    incident_type = res.get('incident_type', "Potential unauthorized access or data exfiltration.")
+    affected_service = res.get('affected_service', "[Service Name]")
+    potentially_impacted_data = res.get('potentially_impacted_data', "[Specify the type of data, e.g., customer information, login credentials, etc.]")
+    status = res.get('status', "The incident is under active investigation, with immediate steps underway to mitigate potential impact.")
+    # The trailing list collects (source, url) of other reports merged into this one
+    return (
+        candidate["title"], vendor, product, candidate["published"], exploits, summary, candidate["link"], candidate["img"],
+        incident_type, affected_service, potentially_impacted_data, status, candidate["source"], []
+    )
+
+def collect_candidates(feeds, last_published, validators=None, cursors=None):
+    """Fetch all feeds and return candidates for entries past each source's cursor.
+
+    `cursors` maps feed url -> (published, guid) of the newest entry already
+    handled; it is advanced in place for every source that yielded new entries.
+    """
+    if cursors is None:
+        cursors = {}
+    candidates = []
+    with metrics.timer("FeedFetch"):
+        fetched = fetch_feeds(feeds, validators=validators)
+    for feed_info, entries in fetched:
+        feed_candidates = select_new_entries(entries, last_published, cursors.get(feed_info["url"]))
+        if feed_candidates:
+            newest_entry, newest_published = max(feed_candidates, key=lambda c: as_utc(c[1]))
+            cursors[feed_info["url"]] = (as_utc(newest_published), entry_guid(newest_entry))
+        candidates.extend(make_candidate(feed_info, entry, entry_published) for entry, entry_published in feed_candidates)
+    metrics.incr("ArticlesSeen", len(candidates))
+    return candidates
+
+def filter_candidates(candidates):
+    """Drop repeated links and links already stored or recently rejected."""
+    seen_links = set()
+    candidates = [c for c in candidates if not (c["link"] in seen_links or seen_links.add(c["link"]))]
+    links = [c["link"] for c in candidates]
+    known_urls = find_existing_urls(links)
+    rejected_urls = find_rejected_urls(links)
+    if known_urls or rejected_urls:
+        logging.info(f"Skipping {len(known_urls)} already stored and {len(rejected_urls)} previously rejected articles")
+    kept = [c for c in candidates if c["link"] not in known_urls and c["link"] not in rejected_urls]
+    metrics.incr("ArticlesSkipped", len(candidates) - len(kept))
+    return kept
 
-def create_entries(feeds, last_published):
+def extract_entries(candidates, deadline=None):
+    """Fetch and extract `candidates`.
+
+    Returns (new_entries, deferred) where deferred holds the candidates whose
+    fetch returned no text or whose extraction failed; their source cursor has
+    already moved past them, so they must be retried from the pending table.
+    """
     new_entries = []
-    for feed_info in feeds:
-        source = feed_info.get("source", "Unknown")
-        url = feed_info.get("url")
-        if not url:
+    deferred = []
+    rejections = {}
+    with metrics.timer("ArticleFetch"):
+        article_texts = fetch_articles([c["link"] for c in candidates])
+    with metrics.timer("Extraction"):
+        extractions = extract_articles(article_texts, deadline)
+    for candidate, article_text, res in zip(candidates, article_texts, extractions):
+        if not article_text:
+            logging.info(f"No article text fetched, deferring: {candidate['link']}")
+            deferred.append(candidate)
             continue
-        feed = feedparser.parse(url)
-        for entry in feed.entries:
-            article_text = fetch_article_text(entry.link)
-            if not article_text:
-                logging.info(f"Skipping article with no text: {entry.link}")
-                continue
-            entry_published = dateutil.parser.parse(entry.published) if hasattr(entry, 'published') else None
-            if not entry_published or entry_published <= last_published:
-                break
-            res = query_AI_extraction(article_text)
-            if not res:
-                continue
-            logging.info(res)
-            vendor = res.get('vendor')
-            if not vendor:
-                logging.info("Skipping entry with unknown vendor")
-                continue
-            vendor = basename(vendor).upper()
-            product = res.get('product', 'Unknown')
-            exploits = res.get('exploits', 'None')
-            summary = res.get('summary', 'None')
-            img = entry.enclosures[0]['url'] if entry.enclosures else None
-            incident_type = res.get('incident_type', "Potential unauthorized access or data exfiltration.")
-            affected_service = res.get('affected_service', "[Service Name]")
-            potentially_impacted_data = res.get('potentially_impacted_data', "[Specify the type of data, e.g., customer information, login credentials, etc.]")
-            status = res.get('status', "The incident is under active investigation, with immediate steps underway to mitigate potential impact.")
-            new_entries.append((
-                entry.title, vendor, product, entry_published, exploits, summary, entry.link, img,
-                incident_type, affected_service, potentially_impacted_data, status, source
-            ))
-    return new_entries
-
-def dedupe_entries(new_entries, window_days=60):
+        if res is None:
+            deferred.append(candidate)
+            continue
+        if not res:
+            rejections[candidate["link"]] = "not_incident"
+            continue
+        logging.info(res)
+        if not res.get('vendor'):
+            logging.info("Skipping entry with unknown vendor")
+            rejections[candidate["link"]] = "no_vendor"
+            continue
+        new_entries.append(build_entry(candidate, res))
+    save_rejected_urls(rejections)
+    metrics.incr("ArticlesExtracted", len(new_entries))
+    metrics.incr("ArticlesRejected", len(rejections))
+    metrics.incr("ArticlesDeferred", len(deferred))
+    return new_entries, deferred
+
+def cluster_entries(new_entries, deadline=None):
+    """Merge entries from this run that report the same incident.
+
+    Entries are grouped per vendor; the earliest report of each cluster is kept
+    and the other members are appended to its references as (source, url).
+    """
+    clusters = []
+    for entry in sorted(new_entries, key=lambda e: as_utc(e[3])):
+        signature = incident_signature(entry[0], entry[5])
+        same_vendor = [c for c in clusters if c[1][1] == entry[1]]
+        verdict, ambiguous = classify(signature, [c[0] for c in same_vendor])
+        match = None
+        if verdict == DUPE:
+            match = min(same_vendor, key=lambda c: hamming_distance(signature, c[0]))
+        elif verdict == AMBIGUOUS:
+            nearest = [same_vendor[i] for i in sorted(ambiguous, key=lambda i: hamming_distance(signature, same_vendor[i][0]))]
+            # An unanswered check keeps the entry separate; dedupe decides later
+            if is_dupe([(c[1][0], c[1][5]) for c in nearest], entry, deadline):
+                match = nearest[0]
+        if match:
+            logging.info(f"Merging {entry[6]} into {match[1][6]}")
+            match[1][13].append((entry[12], entry[6]))
+        else:
+            clusters.append((signature, entry))
+    return [entry for _, entry in clusters]
+
+def load_dedupe_index(vendors, since):
+    """Fetch stored incidents for all `vendors` published after `since` in one
+    query, grouped as vendor -> [(title, summary, signature)]."""
+    vendors = list(set(vendors))
+    index = {vendor: [] for vendor in vendors}
+    if not vendors:
+        return index
+    rows = list(
+        RSSFeed.select(RSSFeed.id, RSSFeed.vendor, RSSFeed.title, RSSFeed.summary, IncidentSignature.signature)
+        .join(IncidentSignature, peewee.JOIN.LEFT_OUTER, on=(IncidentSignature.feed == RSSFeed.id))
+        .where(
+            (RSSFeed.published > since) &
+            (RSSFeed.vendor.in_(vendors))
+        )
+        .tuples()
+    )
+    missing = {
+        feed_id: incident_signature(title, summary)
+        for feed_id, _, title, summary, signature in rows
+        if signature is None
+    }
+    save_incident_signatures(missing)
+    for feed_id, vendor, title, summary, signature in rows:
+        index[vendor].append((title, summary, missing.get(feed_id, signature)))
+    return index
+
+def dedupe_entries(new_entries, window_days=60, deadline=None):
+    """Drop entries that repeat an incident already stored for the same vendor.
+
+    Clear duplicates and clear non-duplicates are decided locally from SimHash
+    signatures; only the ambiguous history rows are sent to the LLM.
+    Returns (kept, deferred); deferred entries are ambiguous ones the LLM
+    could not rule on.
+    """
     one_month_ago = datetime.now(timezone.utc) - timedelta(days=window_days)
+    index = load_dedupe_index([entry[1] or "Unknown" for entry in new_entries], one_month_ago)
     filtered_entries = []
+    deferred = []
     for entry in new_entries:
-        vendor = entry[1] or "Unknown"
-        results = list(
-            RSSFeed.select(RSSFeed.title, RSSFeed.summary)
-            .where(
-                (RSSFeed.published > one_month_ago) &
-                (RSSFeed.vendor == vendor)
-            )
-            .tuples()
-        )
-        if not results or not is_dupe(results, entry):
+        results = index[entry[1] or "Unknown"]
+        if not results:
             filtered_entries.append(entry)
-    return filtered_entries
-
-def insert_entries(entries):
-    for entry in entries:
-        try:
-            RSSFeed.create(
-                title=entry[0],
-                vendor=entry[1],
-                product=entry[2],
-                published=entry[3],
-                exploits=entry[4],
-                summary=entry[5],
-                url=entry[6],
-                img=entry[7],
-                incident_type=entry[8],
-                affected_service=entry[9],
-                potentially_impacted_data=entry[10],
-                status=entry[11],
-                source=entry[12]
-            )
-        except peewee.IntegrityError:
             continue
+        verdict, ambiguous = classify(incident_signature(entry[0], entry[5]), [r[2] for r in results])
+        if verdict == DUPE:
+            logging.info(f"Duplicate found: {entry[0]}")
+            continue
+        if verdict == AMBIGUOUS:
+            dupe = is_dupe([results[i][:2] for i in ambiguous], entry, deadline)
+            if dupe is None:
+                logging.info(f"Deferring ambiguous entry: {entry[0]}")
+                deferred.append(entry)
+                continue
+            if dupe:
+                continue
+        filtered_entries.append(entry)
+    return filtered_entries, deferred
+
+def store_entries(entries):
+    """Insert `entries` in one statement inside a transaction, skipping urls that
+    already exist. Returns the entries that were actually inserted."""
+    # Keep the first entry per url; the same link can appear in more than one feed
+    seen_urls = set()
+    entries = [e for e in entries if not (e[6] in seen_urls or seen_urls.add(e[6]))]
+    if not entries:
+        return []
+    rows = [
+        {
+            "title": entry[0],
+            "vendor": entry[1],
+            "product": entry[2],
+            "published": entry[3],
+            "exploits": entry[4],
+            "summary": entry[5],
+            "url": entry[6],
+            "img": entry[7],
+            "incident_type": entry[8],
+            "affected_service": entry[9],
+            "potentially_impacted_data": entry[10],
+            "status": entry[11],
+            "source": entry[12],
+        }
+        for entry in entries
+    ]
+    by_url = {entry[6]: entry for entry in entries}
+    with db.atomic():
+        inserted = list(
+            RSSFeed.insert_many(rows)
+            .on_conflict_ignore()
+            .returning(RSSFeed.id, RSSFeed.url)
+            .execute()
+        )
+        save_incident_signatures({
+            row.id: incident_signature(by_url[row.url][0], by_url[row.url][5])
+            for row in inserted
+        })
+    inserted_urls = {row.url for row in inserted}
+    skipped = len(entries) - len(inserted_urls)
+    if skipped:
+        logging.info(f"Skipped {skipped} entries already stored")
+    return [entry for entry in entries if entry[6] in inserted_urls]
+
+def lock_vendors(vendors, deadline=None):
+    """Take a transaction-scoped advisory lock per vendor, in sorted order so
+    concurrent workers cannot deadlock. Returns False if the locks could not
+    be taken before `deadline`, or within VENDOR_LOCK_MIN_WAIT once it has
+    passed."""
+    left = deadline.seconds_left() if deadline else None
+    if left is not None:
+        wait = max(left, VENDOR_LOCK_MIN_WAIT)
+        db.execute_sql("SELECT set_config('lock_timeout', %s, true)", (f"{int(wait * 1000)}ms",))
+    try:
+        for vendor in sorted(set(vendors)):
+            db.execute_sql("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (VENDOR_LOCK_CLASS, vendor))
+    except peewee.OperationalError as e:
+        logging.warning(f"Timed out waiting for vendor locks: {e}")
+        return False
+    return True
+
+def commit_entries(entries, deadline=None):
+    """Dedupe `entries` against stored incidents and insert the rest while
+    holding the locks of their vendors, so workers processing other feeds
+    cannot insert the same incident at the same time.
+
+    Returns (inserted, deferred) as store_entries and dedupe_entries do, or
+    None if the locks were not taken in time.
+    """
+    with db.atomic() as txn:
+        if not lock_vendors((entry[1] or "Unknown" for entry in entries), deadline):
+            txn.rollback()
+            return None
+        with metrics.timer("Dedupe"):
+            entries, deferred = dedupe_entries(entries, deadline=deadline)
+        with metrics.timer("Insert"):
+            inserted = store_entries(entries)
+    metrics.incr("EntriesInserted", len(inserted))
+    return inserted, deferred
+
+def resolve_subscribers(vendor_names):
+    """Map each canonical vendor name to the verified subscriber emails of
+    every vendor list containing any vendors row that resolves to it, using a
+    single join."""
+    vendor_names = list(set(vendor_names))
+    recipients = {name: set() for name in vendor_names}
+    if not vendor_names:
+        return recipients
+    index = get_vendor_index()
+    requested = {}
+    for name in vendor_names:
+        for row_name in index.vendor_names(name) or [name]:
+            requested.setdefault(row_name, set()).add(name)
+    query = (
+        Vendor.select(Vendor.name, Subscriber.email)
+        .join(VendorListVendor, on=(VendorListVendor.vendor == Vendor.id))
+        .join(VendorListSubscriber, on=(VendorListSubscriber.vendor_list == VendorListVendor.vendor_list))
+        .join(Subscriber, on=(Subscriber.id == VendorListSubscriber.subscriber))
+        .where(
+            (Vendor.name.in_(list(requested))) &
+            (Subscriber.verified == True)
+        )
+        .distinct()
+        .tuples()
+    )
+    for row_name, email in query:
+        if email:
+            for name in requested[row_name]:
+                recipients[name].add(email)
+    return recipients
+
+def load_digest_subscribers(emails):
+    """Return the subset of `emails` whose subscribers prefer digest delivery.
+
+    subscriber_preferences belongs to the subscriber handler, which creates
+    it on first use; until then everyone gets immediate emails.
+    """
+    emails = list(set(emails))
+    if not emails or not SubscriberPreference.table_exists():
+        return set()
+    query = (
+        Subscriber.select(Subscriber.email)
+        .join(SubscriberPreference, on=(SubscriberPreference.subscriber == Subscriber.id))
+        .where(
+            (Subscriber.email.in_(emails)) &
+            (SubscriberPreference.delivery_mode == 'digest')
+        )
+        .tuples()
+    )
+    return {email for (email,) in query}
 
+def notify_subscribers(entries):
+    """Email the subscribers of each entry's vendor and return the number of
+    messages accepted.
+
+    Immediate subscribers get one email per incident now. For digest
+    subscribers the incidents are queued in pending_digests and go out
+    together from send_pending_digests, which only the scheduled run calls.
+    """
+    try:
+        recipients = resolve_subscribers(entry[1] or "Unknown" for entry in entries)
+        digest_emails = load_digest_subscribers(email for emails in recipients.values() for email in emails)
+    except Exception as e:
+        logging.warning(f"Subscriber lookup failed: {e}")
+        recipients, digest_emails = {}, set()
     emails_count = 0
+    digest_rows = []
     for entry in entries:
-        vendor_name = entry[1] or "Unknown"
+        emails = set(recipients.get(entry[1] or "Unknown", ()))
+        if emails & digest_emails:
+            incident = incident_template_data(entry)
+            digest_rows.extend((email, entry[6], incident) for email in sorted(emails & digest_emails))
+        emails -= digest_emails
+        emails.add("vendexlabs+notification@gmail.com")
+        logging.info(f"Sending email to: {list(emails)}")
+        # Entries are already stored, so a failed send must not stop the others
         try:
-            vendor_obj = Vendor.get_or_none(Vendor.name == vendor_name)
+            emails_count += send_bulk_email_ses(sorted(emails), entry)
         except Exception as e:
-            logging.warning(f"Vendor lookup failed for {vendor_name}: {e}")
-            vendor_obj = None
-        emails = set()
-        if vendor_obj:
-            vendor_list_ids = VendorListVendor.select(VendorListVendor.vendor_list).where(VendorListVendor.vendor == vendor_obj)
-            subscriber_query = Subscriber.select(Subscriber.email).join(VendorListSubscriber, on=(Subscriber.id == VendorListSubscriber.subscriber)).where(VendorListSubscriber.vendor_list.in_(vendor_list_ids), Subscriber.verified == True)
-            emails.update([subscriber.email for subscriber in subscriber_query if subscriber.email])
-        emails.add("vendexlabs+notification@gmail.com")
-        # Deduplicate emails before sending
-        unique_emails = set(emails)
-        if unique_emails:
-            emails_count += len(unique_emails)
-            logging.info(f"Sending email to: {list(unique_emails)}")
-            for email in unique_emails:
-                send_email_ses([email], entry)
+            logging.error(f"Failed to send incident email for {entry[6]}: {e}")
+    try:
+        queue_digests(digest_rows)
+    except Exception as e:
+        logging.error(f"Failed to queue digest incidents: {e}")
+    metrics.incr("EmailsSent", emails_count)
     return emails_count
 
+def send_pending_digests(deadline=None):
+    """Send every queued digest and return the number of messages accepted.
+
+    Recipients waiting on the same incidents share one bulk send. Rows are
+    only removed for accepted recipients, so anything unsent is retried by
+    the next run.
+    """
+    with metrics.timer("Email"):
+        digests = load_pending_digests()
+        groups = {}
+        for email, items in digests.items():
+            urls = tuple(url for url, _ in items)
+            groups.setdefault(urls, ([incident for _, incident in items], []))[1].append(email)
+        sent = 0
+        for done, (urls, (incidents, emails)) in enumerate(groups.items()):
+            if deadline and deadline.expired():
+                logging.warning(f"Approaching deadline, leaving {len(groups) - done} digests queued")
+                break
+            logging.info(f"Sending digest of {len(incidents)} incidents to: {emails}")
+            try:
+                accepted = send_digest_email_ses(sorted(emails), incidents)
+            except Exception as e:
+                logging.error(f"Failed to send digest to {emails}: {e}")
+                continue
+            clear_pending_digests(accepted, urls)
+            sent += len(accepted)
+    metrics.incr("EmailsSent", sent)
+    return sent
+
+def ensure_tables():
+    db.create_tables([
+        FeedCache, FeedCursor, RejectedArticle, ExtractionCache, IncidentSignature,
+        PendingArticle, PendingDigest
+    ], safe=True)
+
+def entry_candidates(entries, candidates):
+    """Candidates behind `entries`, including the reports merged into them."""
+    by_link = {c["link"]: c for c in candidates}
+    links = [link for entry in entries for link in [entry[6]] + [url for _, url in entry[13]]]
+    return [by_link[link] for link in links if link in by_link]
+
+def process_feeds(feeds, hours=3, force_refresh=False, deadline=None):
+    """Run the fetch -> extract -> cluster -> dedupe -> insert -> notify
+    pipeline for `feeds` and return a summary message.
+
+    Articles checkpointed by an earlier run go first. Extraction runs in
+    chunks, then the extracted entries are clustered together so reports from
+    different sources merge, and are deduped and committed chunk by chunk
+    under per-vendor locks (see commit_entries). Extraction stops
+    EXTRACTION_MARGIN_MS before `deadline` so the entries already extracted
+    can still be committed; the articles not reached are checkpointed for the
+    next invocation. Digest incidents are only queued; the caller sends them.
+    """
+    current_time = datetime.now(timezone.utc)
+    last_published = current_time - timedelta(hours=hours)
+    # A forced refresh ignores stored validators and cursors so backfills
+    # see full feeds and fall back to the `hours` window
+    if force_refresh:
+        validators, cursors = {}, {}
+    else:
+        validators, cursors = load_feed_validators(feeds), load_feed_cursors(feeds)
+    pending = load_pending_candidates(feeds)
+    candidates = filter_candidates(pending + collect_candidates(feeds, last_published, validators, cursors))
+    logging.info(f"Since last published: {last_published}")
+
+    deferred, remaining = [], []
+    retry = lambda chunk: [{**c, "attempts": c.get("attempts", 0) + 1} for c in chunk]
+    new_entries = []
+    for start in range(0, len(candidates), PIPELINE_CHUNK_SIZE):
+        if deadline and deadline.expired(EXTRACTION_MARGIN_MS):
+            remaining = candidates[start:]
+            break
+        chunk_entries, chunk_deferred = extract_entries(candidates[start:start + PIPELINE_CHUNK_SIZE], deadline)
+        new_entries.extend(chunk_entries)
+        deferred.extend(retry(chunk_deferred))
+
+    with metrics.timer("Dedupe"):
+        new_entries = cluster_entries(new_entries, deadline)
+    inserted_count, emails_count = 0, 0
+    # Extracted entries are always committed; past the deadline dedupe only
+    # skips its LLM checks and defers the ambiguous entries
+    for start in range(0, len(new_entries), PIPELINE_CHUNK_SIZE):
+        logging.info("Inserting entries...")
+        committed = commit_entries(new_entries[start:start + PIPELINE_CHUNK_SIZE], deadline)
+        if committed is None:
+            remaining.extend(entry_candidates(new_entries[start:], candidates))
+            break
+        inserted_entries, deferred_entries = committed
+        deferred.extend(retry(entry_candidates(deferred_entries, candidates)))
+        with metrics.timer("Email"):
+            emails_count += notify_subscribers(inserted_entries)
+        inserted_count += len(inserted_entries)
+
+    if remaining:
+        logging.warning(f"Approaching deadline, checkpointing {len(remaining)} articles")
+    replace_pending_candidates([c["link"] for c in pending], remaining + deferred)
+    save_feed_validators(validators)
+    save_feed_cursors(cursors)
+    if not inserted_count and not remaining:
+        return "No new entries found."
+    body = f"Inserted {inserted_count} new entries. Sent {emails_count} emails."
+    if remaining:
+        body += f" Checkpointed {len(remaining)} articles for the next run."
+    return body
+
+def make_feed_jobs(feeds, hours, force_refresh):
+    return [{"feed": feed_info, "hours": hours, "force_refresh": force_refresh} for feed_info in feeds if feed_info.get("url")]
+
+def run_feed_job(job, deadline=None):
+    db.connect(reuse_if_open=True)
+    try:
+        return process_feeds([job["feed"]], job.get("hours", 3), job.get("force_refresh", False), deadline)
+    finally:
+        db.close()
+
+def handle_worker_event(event, deadline=None):
+    """Process one feed job per SQS record, reporting failed records so only
+    those are retried."""
+    failures = []
+    for record in event["Records"]:
+        try:
+            logging.info(run_feed_job(json.loads(record["body"]), deadline))
+        except Exception as e:
+            logging.error(f"Feed job failed: {record.get('body')}, error: {e}")
+            failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": failures}
+
 def lambda_handler(event, context):
+    """Entry point for the scheduled run and for queue workers.
+
+    - SQS events are worker invocations: each record is one feed job.
+    - With FEED_QUEUE_URL set, the scheduled run only enqueues one job per feed.
+    - {"mode": "local_workers"} fans the jobs out to an in-process queue.
+    - Otherwise all feeds are processed in this invocation.
+
+    Workers only queue digest incidents. The scheduled run sends them once its
+    own work is done; in queue mode that is the digest of the previous
+    cycle's workers, since this cycle's jobs have not run yet.
+    """
+    deadline = Deadline(context)
+    metrics.reset()
+    reset_vendor_index()
+    if is_sqs_event(event):
+        try:
+            return handle_worker_event(event, deadline)
+        finally:
+            metrics.emit(Mode="worker")
+    mode = event.get("mode", "queue" if FEED_QUEUE_URL else "inline")
     try:
-        current_time = datetime.now(timezone.utc)
         hours_ago = event.get("hours", 3)
-        last_published = current_time - timedelta(hours=hours_ago)
+        force_refresh = bool(event.get("force_refresh"))
         db.connect(reuse_if_open=True)
-        new_entries = create_entries(FEEDS, last_published)
-        logging.info(f"Since last published: {last_published}")
-        if not new_entries:
-            return {"statusCode": 200, "body": "No new entries found."}
-        new_entries = dedupe_entries(new_entries)
-        logging.info("Inserting entries...")
-        emails_count = insert_entries(new_entries)
+        ensure_tables()
+        if mode == "queue":
+            sent = SQSQueue(FEED_QUEUE_URL).send(make_feed_jobs(FEEDS, hours_ago, force_refresh))
+            digests = send_pending_digests(deadline)
+            body = f"Enqueued {sent} feed jobs. Sent {digests} digest emails."
+        elif mode == "local_workers":
+            queue = LocalQueue(lambda job: run_feed_job(job, deadline), max_workers=FEED_WORKERS)
+            queue.send(make_feed_jobs(FEEDS, hours_ago, force_refresh))
+            results = queue.drain()
+            body = json.dumps({
+                "jobs": len(results),
+                "failed": sum(1 for _, _, error in results if error),
+                "results": [result for _, result, _ in results if result],
+                "digests": send_pending_digests(deadline),
+            })
+        else:
+            body = process_feeds(FEEDS, hours_ago, force_refresh, deadline)
+            body += f" Sent {send_pending_digests(deadline)} digest emails."
         db.close()
-        return {"statusCode": 200, "body": f"Inserted {len(new_entries)} new entries. Sent {emails_count} emails."}
+        return {"statusCode": 200, "body": body}
     except Exception as e:
         logging.error(f"Error in lambda_handler: {e}")
+        metrics.incr("Errors")
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+    finally:
+        metrics.emit(Mode=mode)
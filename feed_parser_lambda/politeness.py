@@ -0,0 +1,111 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# At most this many requests in flight to one host
+HOST_MAX_CONCURRENCY = int(os.getenv("HOST_MAX_CONCURRENCY", "2"))
+# Minimum gap in seconds between request starts to one host
+HOST_MIN_DELAY = float(os.getenv("HOST_MIN_DELAY", "0.5"))
+# Back-off applied to a host that throttles us without sending Retry-After
+HOST_THROTTLE_BACKOFF = float(os.getenv("HOST_THROTTLE_BACKOFF", "5"))
+# Longest a host can push back our requests, whatever its Retry-After says
+MAX_RETRY_AFTER = float(os.getenv("MAX_RETRY_AFTER", "30"))
+
+
+class HostBusy(Exception):
+    """The host cannot take another request within the caller's wait limit."""
+
+
+def host_key(url):
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date),
+    or None when the header is missing or malformed."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+class _HostState:
+    __slots__ = ("semaphore", "lock", "next_start")
+
+    def __init__(self, max_concurrency):
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+
+class HostScheduler:
+    """Per-host concurrency cap and request spacing shared by all fetch threads."""
+
+    def __init__(self, max_concurrency=HOST_MAX_CONCURRENCY, min_delay=HOST_MIN_DELAY, max_defer=MAX_RETRY_AFTER):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_delay = min_delay
+        self.max_defer = max_defer
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, url):
+        key = host_key(url)
+        with self._lock:
+            state = self._hosts.get(key)
+            if state is None:
+                state = self._hosts[key] = _HostState(self.max_concurrency)
+            return state
+
+    @contextmanager
+    def slot(self, url, max_wait=None):
+        """Hold one of the host's request slots, waiting for its turn to start.
+
+        Raises HostBusy instead of waiting longer than `max_wait` seconds.
+        """
+        state = self._state(url)
+        if not state.semaphore.acquire(timeout=max_wait):
+            raise HostBusy(f"no free slot for {host_key(url)} within {max_wait}s")
+        try:
+            with state.lock:
+                now = time.monotonic()
+                start = max(now, state.next_start)
+                if max_wait is not None and start - now > max_wait:
+                    raise HostBusy(f"{host_key(url)} is backed off for another {start - now:.0f}s")
+                state.next_start = start + self.min_delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+        finally:
+            state.semaphore.release()
+
+    def defer(self, url, seconds):
+        """Keep new requests to the host from starting for `seconds`, capped at
+        `max_defer`."""
+        state = self._state(url)
+        with state.lock:
+            state.next_start = max(state.next_start, time.monotonic() + min(seconds, self.max_defer))
+
+    def interleave(self, urls):
+        """Indexes of `urls` reordered round-robin across hosts, so a pool of
+        workers is not tied up waiting on a single busy host."""
+        by_host = {}
+        for i, url in enumerate(urls):
+            by_host.setdefault(host_key(url), []).append(i)
+        queues = list(by_host.values())
+        order = []
+        for depth in range(max((len(q) for q in queues), default=0)):
+            order.extend(q[depth] for q in queues if depth < len(q))
+        return order
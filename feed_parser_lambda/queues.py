@@ -0,0 +1,72 @@
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+SQS_REGION = os.getenv("AWS_REGION", "us-east-1")
+# SQS accepts at most 10 messages per SendMessageBatch call
+SQS_BATCH_SIZE = 10
+
+
+class LocalQueue:
+    """In-process queue for tests and local runs.
+
+    Jobs are held in memory and processed by `handler` on a thread pool when
+    the queue is drained.
+    """
+
+    def __init__(self, handler, max_workers=4):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.jobs = []
+
+    def send(self, jobs):
+        jobs = list(jobs)
+        self.jobs.extend(jobs)
+        return len(jobs)
+
+    def drain(self):
+        """Process all pending jobs in parallel; returns (job, result, error)
+        tuples in send order."""
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            return []
+
+        def run(job):
+            try:
+                return job, self.handler(job), None
+            except Exception as e:
+                logging.error(f"Job failed: {job}, error: {e}")
+                return job, None, e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(jobs)))) as executor:
+            return list(executor.map(run, jobs))
+
+
+class SQSQueue:
+    """Sends jobs as JSON messages to an SQS queue consumed by worker Lambdas."""
+
+    def __init__(self, queue_url, client=None):
+        self.queue_url = queue_url
+        self.client = client or boto3.client("sqs", region_name=SQS_REGION)
+
+    def send(self, jobs):
+        jobs = list(jobs)
+        sent = 0
+        for start in range(0, len(jobs), SQS_BATCH_SIZE):
+            batch = jobs[start:start + SQS_BATCH_SIZE]
+            response = self.client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{"Id": str(i), "MessageBody": json.dumps(job)} for i, job in enumerate(batch)]
+            )
+            sent += len(response.get("Successful", []))
+            for failure in response.get("Failed", []):
+                logging.error(f"Failed to enqueue job {batch[int(failure['Id'])]}: {failure.get('Message')}")
+        return sent
+
+
+def is_sqs_event(event):
+    records = event.get("Records") or []
+    return bool(records) and all(record.get("eventSource") == "aws:sqs" for record in records)
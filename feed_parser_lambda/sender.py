@@ -1,89 +1,266 @@
+import os
 import json
+import hashlib
+from urllib.parse import urlencode
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, BotoCoreError
 import logging
 
+from metrics import metrics
+
 SES_REGION = 'us-east-1'
+# Point at a local SES stand-in (e.g. moto server) when set
+SES_ENDPOINT_URL = os.getenv("SES_ENDPOINT_URL")
 SENDER_EMAIL = 'do-not-reply@notification.vendexlabs.com'
 LOGO_URL = "https://vendexlabstest.s3.us-east-1.amazonaws.com/logo.png"
+# Subscription management page linked from each email footer, if configured
+MANAGE_SUBSCRIPTIONS_URL = os.getenv("MANAGE_SUBSCRIPTIONS_URL")
+# SES accepts at most 50 destinations per SendBulkTemplatedEmail call
+SES_BULK_BATCH_SIZE = 50
 
-def send_email_ses(recipients, entry):
-
-    title, vendor, product, published, exploits, summary, url, img, incident_type, affected_service, potentially_impacted_data, status, source = entry
-    logging.info(f"Sending email to: {recipients}")
-
-    image_html = ""
-    if img:
-        image_html = f'''
-        <div class="image-container">
-            <img src="{img}" alt="Image" style="max-width:50%; border-radius:8px;">
-        </div>
-        '''
-
-    subject = f"{source}: {title}" if source else title
-
-    body = f"""
-    <html>
-        <head>
+EMAIL_HEAD = """        <head>
             <style>
-                body {{ font-family: Calibri, sans-serif; background:#f9f9f9; padding:20px; color:#333; }}
-                .container {{ background:#fff; padding:20px; border-radius:8px; box-shadow:0 2px 4px rgba(0,0,0,0.1); }}
-                .logo-banner-container {{
+                body { font-family: Calibri, sans-serif; background:#f9f9f9; padding:20px; color:#333; }
+                .container { background:#fff; padding:20px; border-radius:8px; box-shadow:0 2px 4px rgba(0,0,0,0.1); }
+                .logo-banner-container {
                     background-color: #EFEEEC;
                     padding: 0 20px;
-                }}
-                .logo-banner {{
-                    background-image: url('{LOGO_URL}');
+                }
+                .logo-banner {
+                    background-image: url('""" + LOGO_URL + """');
                     background-size: contain;
                     background-repeat: no-repeat;
                     background-position: center;
                     height: 100px;
                     width: 100%;
-                }}
-                .content {{ padding: 20px; }}
-                .footer {{ margin-top:20px; font-size:12px; color:#777; text-align: center; }}
-                .image-container {{
+                }
+                .content { padding: 20px; }
+                .footer { margin-top:20px; font-size:12px; color:#777; text-align: center; }
+                .image-container {
                     text-align: center;
                     margin: 20px 0;
-                }}
+                }
             </style>
         </head>
-        <body>
+"""
+
+# Triple braces: the subject is plain text, so Handlebars must not HTML-escape it
+INCIDENT_TEMPLATE_SUBJECT = "{{{subject}}}"
+INCIDENT_TEMPLATE_HTML = """
+    <html>
+""" + EMAIL_HEAD + """        <body>
             <div class="container">
                 <div class="logo-banner-container">
                     <div class="logo-banner"></div>
                 </div>
                 <div class="content">
                     <p><em>Notification from VendexLabs</em></p>
-                    <p><strong>Source:</strong> {source}</p>
-                    <p><strong>Vendor:</strong> {vendor}</p>
-                    <p><strong>Product:</strong> {product} </p>
-                    <p><strong>Published Date:</strong> {published}</p>
-                    <p><strong>Incident Type:</strong> {incident_type}</p>
-                    <p><strong>Affected Service:</strong> {affected_service}</p>
-                    <p><strong>Potentially Impacted Data:</strong> {potentially_impacted_data}</p>
-                    <p><strong>Status:</strong> {status}</p>
-                    <p><strong>Summary:</strong> {summary}</p>
-                    {image_html}
-                    <p>Reference URL: <a href="{url}">{url}</a></p>
+                    <p><strong>Source:</strong> {{source}}</p>
+                    <p><strong>Vendor:</strong> {{vendor}}</p>
+                    <p><strong>Product:</strong> {{product}} </p>
+                    <p><strong>Published Date:</strong> {{published}}</p>
+                    <p><strong>Incident Type:</strong> {{incident_type}}</p>
+                    <p><strong>Affected Service:</strong> {{affected_service}}</p>
+                    <p><strong>Potentially Impacted Data:</strong> {{potentially_impacted_data}}</p>
+                    <p><strong>Status:</strong> {{status}}</p>
+                    <p><strong>Summary:</strong> {{summary}}</p>
+                    {{#if img}}
+                    <div class="image-container">
+                        <img src="{{img}}" alt="Image" style="max-width:50%; border-radius:8px;">
+                    </div>
+                    {{/if}}
+                    <p>Reference URL: <a href="{{url}}">{{url}}</a></p>
+                    {{#if references}}
+                    <p>Also reported by: {{#each references}}<a href="{{url}}">{{source}}</a> {{/each}}</p>
+                    {{/if}}
                     <p class="footer">Contact: info@vendexlabs.com</p>
+                    <p class="footer">This notification was sent to {{recipient}}.{{#if manage_url}} <a href="{{manage_url}}">Manage subscriptions</a>{{/if}}</p>
                     <p class="footer"> Copyright 2025 VendexLabs.  All rights reserved. </p>
                 </div>
             </div>
         </body>
     </html>
     """
+# Versioned by content so an edited template is created under a new name
+INCIDENT_TEMPLATE_NAME = "vendexlabs-incident-" + hashlib.sha256(
+    (INCIDENT_TEMPLATE_SUBJECT + INCIDENT_TEMPLATE_HTML).encode("utf-8")
+).hexdigest()[:12]
 
+DIGEST_TEMPLATE_SUBJECT = "VendexLabs digest: {{count}} new incidents"
+DIGEST_TEMPLATE_HTML = """
+    <html>
+""" + EMAIL_HEAD + """        <body>
+            <div class="container">
+                <div class="logo-banner-container">
+                    <div class="logo-banner"></div>
+                </div>
+                <div class="content">
+                    <p><em>Notification digest from VendexLabs: {{count}} new incidents</em></p>
+                    {{#each incidents}}
+                    <hr>
+                    <p><strong>{{title}}</strong></p>
+                    <p><strong>Source:</strong> {{source}}</p>
+                    <p><strong>Vendor:</strong> {{vendor}}</p>
+                    <p><strong>Product:</strong> {{product}} </p>
+                    <p><strong>Published Date:</strong> {{published}}</p>
+                    <p><strong>Incident Type:</strong> {{incident_type}}</p>
+                    <p><strong>Affected Service:</strong> {{affected_service}}</p>
+                    <p><strong>Potentially Impacted Data:</strong> {{potentially_impacted_data}}</p>
+                    <p><strong>Status:</strong> {{status}}</p>
+                    <p><strong>Summary:</strong> {{summary}}</p>
+                    <p>Reference URL: <a href="{{url}}">{{url}}</a></p>
+                    {{#if references}}
+                    <p>Also reported by: {{#each references}}<a href="{{url}}">{{source}}</a> {{/each}}</p>
+                    {{/if}}
+                    {{/each}}
+                    <p class="footer">Contact: info@vendexlabs.com</p>
+                    <p class="footer">This notification was sent to {{recipient}}.{{#if manage_url}} <a href="{{manage_url}}">Manage subscriptions</a>{{/if}}</p>
+                    <p class="footer"> Copyright 2025 VendexLabs.  All rights reserved. </p>
+                </div>
+            </div>
+        </body>
+    </html>
+    """
+DIGEST_TEMPLATE_NAME = "vendexlabs-digest-" + hashlib.sha256(
+    (DIGEST_TEMPLATE_SUBJECT + DIGEST_TEMPLATE_HTML).encode("utf-8")
+).hexdigest()[:12]
+
+_ses_client = None
+_ready_templates = set()
+
+
+def get_ses_client():
+    """Module-wide SES client, reused across sends and warm invocations."""
+    global _ses_client
+    if _ses_client is None:
+        _ses_client = boto3.client('ses', region_name=SES_REGION, endpoint_url=SES_ENDPOINT_URL)
+    return _ses_client
+
+
+def ensure_template(name, subject, html_part):
+    """Create the SES template if it is missing. Returns False when it could
+    not be checked or created, so the caller can skip the send."""
+    if name in _ready_templates:
+        return True
+    ses = get_ses_client()
     try:
-        ses = boto3.client('ses', region_name=SES_REGION)
-        response = ses.send_email(
-            Source=SENDER_EMAIL,
-            Destination={'ToAddresses': recipients},
-            Message={
-                'Subject': {'Data': subject},
-                'Body': {'Html': {'Data': body}}
-            }
-        )
-        logging.info(f"Email sent! Message ID: {response['MessageId']}")
+        try:
+            ses.get_template(TemplateName=name)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TemplateDoesNotExist':
+                raise
+            ses.create_template(Template={
+                'TemplateName': name,
+                'SubjectPart': subject,
+                'HtmlPart': html_part,
+            })
+            logging.info(f"Created SES template {name}")
     except ClientError as e:
-        logging.error(f"Error sending email: {e.response['Error']['Message']}")
\ No newline at end of file
+        # Another invocation created it between our get and create
+        if e.response['Error']['Code'] != 'AlreadyExists':
+            logging.error(f"Error preparing SES template {name}: {e}")
+            return False
+    except BotoCoreError as e:
+        logging.error(f"Error preparing SES template {name}: {e}")
+        return False
+    _ready_templates.add(name)
+    return True
+
+
+def manage_subscriptions_url(email):
+    if not MANAGE_SUBSCRIPTIONS_URL:
+        return ""
+    return f"{MANAGE_SUBSCRIPTIONS_URL}?{urlencode({'email': email})}"
+
+
+def recipient_template_data(email):
+    return {"recipient": email, "manage_url": manage_subscriptions_url(email)}
+
+
+def incident_template_data(entry):
+    title, vendor, product, published, exploits, summary, url, img, incident_type, affected_service, potentially_impacted_data, status, source = entry[:13]
+    references = entry[13] if len(entry) > 13 else []
+    return {
+        "subject": f"{source}: {title}" if source else title,
+        "title": title,
+        "source": str(source),
+        "vendor": str(vendor),
+        "product": str(product),
+        "published": str(published),
+        "incident_type": str(incident_type),
+        "affected_service": str(affected_service),
+        "potentially_impacted_data": str(potentially_impacted_data),
+        "status": str(status),
+        "summary": str(summary),
+        "img": img or "",
+        "url": url,
+        "references": [{"source": ref_source or ref_url, "url": ref_url} for ref_source, ref_url in references],
+    }
+
+
+def send_bulk_templated(recipients, template_name, template_data):
+    """Send `template_name` to every recipient (one To address each), up to
+    SES_BULK_BATCH_SIZE per call. Returns the recipients whose messages were
+    accepted."""
+    recipients = list(recipients)
+    default_data = json.dumps(template_data)
+    ses = get_ses_client()
+    sent = []
+    for start in range(0, len(recipients), SES_BULK_BATCH_SIZE):
+        batch = recipients[start:start + SES_BULK_BATCH_SIZE]
+        try:
+            metrics.incr("SESCalls")
+            response = ses.send_bulk_templated_email(
+                Source=SENDER_EMAIL,
+                Template=template_name,
+                DefaultTemplateData=default_data,
+                Destinations=[
+                    {
+                        'Destination': {'ToAddresses': [email]},
+                        'ReplacementTemplateData': json.dumps(recipient_template_data(email)),
+                    }
+                    for email in batch
+                ]
+            )
+        except ClientError as e:
+            logging.error(f"Error sending bulk email: {e.response['Error']['Message']}")
+            continue
+        except BotoCoreError as e:
+            logging.error(f"Error sending bulk email: {e}")
+            continue
+        for email, status in zip(batch, response.get('Status', [])):
+            if status.get('Status', 'Success') == 'Success' and status.get('MessageId'):
+                sent.append(email)
+            else:
+                logging.error(f"Error sending email to {email}: {status.get('Status')} {status.get('Error', '')}")
+    logging.info(f"Bulk email sent to {len(sent)}/{len(recipients)} recipients")
+    return sent
+
+
+def send_bulk_email_ses(recipients, entry):
+    """Send the incident email to every recipient through SES bulk templated
+    sends. Returns the number of messages accepted."""
+    recipients = list(recipients)
+    if not recipients:
+        return 0
+    if not ensure_template(INCIDENT_TEMPLATE_NAME, INCIDENT_TEMPLATE_SUBJECT, INCIDENT_TEMPLATE_HTML):
+        return 0
+    return len(send_bulk_templated(recipients, INCIDENT_TEMPLATE_NAME, incident_template_data(entry)))
+
+
+def send_digest_email_ses(recipients, incidents):
+    """Send one digest listing all `incidents` (incident_template_data dicts)
+    to every recipient. Returns the recipients whose messages were accepted."""
+    recipients = list(recipients)
+    if not recipients or not incidents:
+        return []
+    if len(incidents) == 1:
+        template_name, subject, html_part = INCIDENT_TEMPLATE_NAME, INCIDENT_TEMPLATE_SUBJECT, INCIDENT_TEMPLATE_HTML
+        template_data = incidents[0]
+    else:
+        template_name, subject, html_part = DIGEST_TEMPLATE_NAME, DIGEST_TEMPLATE_SUBJECT, DIGEST_TEMPLATE_HTML
+        template_data = {"count": len(incidents), "incidents": incidents}
+    if not ensure_template(template_name, subject, html_part):
+        return []
+    return send_bulk_templated(recipients, template_name, template_data)
+
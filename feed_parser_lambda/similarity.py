@@ -0,0 +1,76 @@
+import os
+import re
+import hashlib
+from collections import Counter
+
+SIGNATURE_BITS = 64
+# Hamming distance at or below which two incidents are treated as the same story,
+# and at or above which they are treated as unrelated. Anything in between is
+# left to the LLM.
+SIMHASH_DUPE_DISTANCE = int(os.getenv("SIMHASH_DUPE_DISTANCE", "6"))
+SIMHASH_DISTINCT_DISTANCE = int(os.getenv("SIMHASH_DISTINCT_DISTANCE", "24"))
+
+DUPE = "dupe"
+DISTINCT = "distinct"
+AMBIGUOUS = "ambiguous"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "the and for with that this from have has had was were are its into over after about "
+    "their they them than then been also which while will would could more most some such "
+    "not but all any can may our out new said says".split()
+)
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if len(t) > 2 and t not in _STOPWORDS]
+
+
+def _features(text):
+    tokens = tokenize(text)
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return features
+
+
+def _feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text):
+    """64-bit SimHash over weighted unigrams and bigrams of `text`."""
+    weights = [0] * SIGNATURE_BITS
+    for feature, weight in _features(text).items():
+        h = _feature_hash(feature)
+        for bit in range(SIGNATURE_BITS):
+            weights[bit] += weight if h >> bit & 1 else -weight
+    signature = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            signature |= 1 << bit
+    return signature
+
+
+def incident_signature(title, summary):
+    # Stored in a signed Postgres BIGINT
+    signature = simhash(f"{title or ''} {summary or ''}")
+    return signature - (1 << SIGNATURE_BITS) if signature >= 1 << (SIGNATURE_BITS - 1) else signature
+
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & ((1 << SIGNATURE_BITS) - 1)).count("1")
+
+
+def classify(signature, candidates):
+    """Compare `signature` against candidate signatures.
+
+    Returns (DUPE | DISTINCT | AMBIGUOUS, ambiguous_indexes) where the indexes
+    point into `candidates` for the pairs that need a closer look.
+    """
+    distances = [hamming_distance(signature, candidate) for candidate in candidates]
+    if any(d <= SIMHASH_DUPE_DISTANCE for d in distances):
+        return DUPE, []
+    ambiguous = [i for i, d in enumerate(distances) if d < SIMHASH_DISTINCT_DISTANCE]
+    if ambiguous:
+        return AMBIGUOUS, ambiguous
+    return DISTINCT, []
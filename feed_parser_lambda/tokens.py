@@ -0,0 +1,76 @@
+import os
+import hashlib
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# gpt-4o family encoding
+TOKEN_ENCODING = "o200k_base"
+TOKEN_ENCODING_URL = "https://openaipublicblob.blob.core.windows.net/encodings/o200k_base.tiktoken"
+# tiktoken reads the BPE file from here; the lambda layer ships it so cold
+# starts inside the VPC never have to download it
+TIKTOKEN_CACHE_DIR = os.getenv("TIKTOKEN_CACHE_DIR")
+# Rough English-text average used when tiktoken is not available
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+
+def encoding_bundled():
+    """True when the encoding is already in TIKTOKEN_CACHE_DIR (tiktoken names
+    cached files by the sha1 of their URL), or when no cache dir is set and
+    tiktoken may download it."""
+    if not TIKTOKEN_CACHE_DIR:
+        return True
+    cache_key = hashlib.sha1(TOKEN_ENCODING_URL.encode()).hexdigest()
+    return os.path.exists(os.path.join(TIKTOKEN_CACHE_DIR, cache_key))
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        if not encoding_bundled():
+            logging.warning(f"{TOKEN_ENCODING} not found in {TIKTOKEN_CACHE_DIR}, estimating tokens")
+            _encoding = False
+            return None
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            logging.warning(f"tiktoken encoding unavailable, estimating tokens: {e}")
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_tokens(text, max_tokens):
+    encoding = get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+def fit_paragraphs(paragraphs, max_tokens):
+    """Join whole paragraphs until `max_tokens` is reached; the paragraph that
+    crosses the budget is cut at the token boundary."""
+    kept = []
+    used = 0
+    for paragraph in paragraphs:
+        tokens = count_tokens(paragraph) + 1
+        if used + tokens > max_tokens:
+            remaining = max_tokens - used
+            if remaining > 0:
+                kept.append(truncate_tokens(paragraph, remaining))
+            break
+        kept.append(paragraph)
+        used += tokens
+    return " ".join(kept)
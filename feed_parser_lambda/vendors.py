@@ -0,0 +1,87 @@
+import logging
+import threading
+from functools import lru_cache
+
+from cleanco import basename
+
+from models import Vendor, VendorProfile
+
+
+@lru_cache(maxsize=4096)
+def normalize_vendor(name):
+    """Company name without legal suffixes, upper-cased: "Okta, Inc." -> "OKTA"."""
+    return " ".join(basename(name or "").upper().split())
+
+
+class VendorIndex:
+    """Maps vendor names as the LLM writes them to one canonical name per vendor.
+
+    Canonical names come from vendor_profiles, with each profile's aliases
+    pointing at it, and from the vendors table for names without a profile.
+    Only whole names resolve: "MICROSOFT AZURE" needs an alias on the
+    MICROSOFT profile, since matching leading words would also send "Apple
+    Hospitality REIT" to APPLE.
+    """
+
+    def __init__(self, profiles=(), vendor_names=()):
+        self.aliases = {}
+        # canonical name -> names of vendors rows that subscribers follow
+        self.names = {}
+        for vendor, aliases in profiles:
+            canonical = normalize_vendor(vendor)
+            if canonical:
+                self.aliases[canonical] = canonical
+        for vendor, aliases in profiles:
+            canonical = normalize_vendor(vendor)
+            for alias in aliases or []:
+                key = normalize_vendor(alias) if isinstance(alias, str) else ""
+                if canonical and key:
+                    self.aliases.setdefault(key, canonical)
+        for name in vendor_names:
+            key = normalize_vendor(name)
+            if key:
+                canonical = self.aliases.setdefault(key, key)
+                self.names.setdefault(canonical, []).append(name)
+
+    def canonical(self, name):
+        key = normalize_vendor(name)
+        return self.aliases.get(key, key)
+
+    def vendor_names(self, canonical):
+        """Names in the vendors table that resolve to `canonical`."""
+        return self.names.get(canonical, [])
+
+
+def load_vendor_index():
+    try:
+        profiles = list(VendorProfile.select(VendorProfile.vendor, VendorProfile.alias).tuples())
+    except Exception as e:
+        logging.warning(f"Could not load vendor profiles: {e}")
+        profiles = []
+    vendor_names = [name for (name,) in Vendor.select(Vendor.name).tuples()]
+    logging.info(f"Vendor index: {len(profiles)} profiles, {len(vendor_names)} vendors")
+    return VendorIndex(profiles, vendor_names)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_vendor_index():
+    """The index for the current invocation, loaded on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = load_vendor_index()
+        return _index
+
+
+def reset_vendor_index():
+    """Drop the cached index so the next run picks up vendor changes."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def canonical_vendor(name):
+    return get_vendor_index().canonical(name)
@@ -70,6 +70,17 @@ class Subscriber(BaseModel):
     class Meta:
         table_name = 'subscribers'
 
+class SubscriberPreference(BaseModel):
+    subscriber = ForeignKeyField(Subscriber, primary_key=True, backref='preference', on_delete='CASCADE')
+    delivery_mode = CharField(
+        max_length=10,
+        choices=[('immediate', 'Immediate'), ('digest', 'Digest')],
+        default='immediate'
+    )
+
+    class Meta:
+        table_name = 'subscriber_preferences'
+
 class VendorListSubscriber(BaseModel):
     vendor_list = ForeignKeyField(VendorList, backref='subscribers')
     subscriber = ForeignKeyField(Subscriber, backref='lists')
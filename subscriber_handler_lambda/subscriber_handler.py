@@ -1,7 +1,9 @@
 import json
 from peewee import IntegrityError
 from config import db
-from models import VendorList, Subscriber, VendorListSubscriber, Account, AccountUser, User
+from models import VendorList, Subscriber, SubscriberPreference, VendorListSubscriber, Account, AccountUser, User
+
+DELIVERY_MODES = ('immediate', 'digest')
 
 def get_user_email(event):
     claims = None
@@ -158,6 +160,58 @@ def toggle_verified_status(account_id, subscriber_email):
     finally:
         db.close()
 
+def get_delivery_mode(account_id, subscriber_email):
+    db.connect(reuse_if_open=True)
+    try:
+        db.create_tables([SubscriberPreference], safe=True)
+        subscriber = Subscriber.get(Subscriber.email == subscriber_email)
+        preference = SubscriberPreference.get_or_none(SubscriberPreference.subscriber == subscriber)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                "email": subscriber.email,
+                "delivery_mode": preference.delivery_mode if preference else 'immediate'
+            })
+        }
+    except Subscriber.DoesNotExist:
+        return {
+            'statusCode': 404,
+            'body': json.dumps("Subscriber not found.")
+        }
+    finally:
+        db.close()
+
+def set_delivery_mode(account_id, subscriber_email, delivery_mode):
+    db.connect(reuse_if_open=True)
+    try:
+        db.create_tables([SubscriberPreference], safe=True)
+        subscriber = Subscriber.get(Subscriber.email == subscriber_email)
+        SubscriberPreference.insert(subscriber=subscriber, delivery_mode=delivery_mode).on_conflict(
+            conflict_target=[SubscriberPreference.subscriber],
+            update={SubscriberPreference.delivery_mode: delivery_mode}
+        ).execute()
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                "email": subscriber.email,
+                "delivery_mode": delivery_mode
+            })
+        }
+    except Subscriber.DoesNotExist:
+        db.rollback()
+        return {
+            'statusCode': 404,
+            'body': json.dumps("Subscriber not found.")
+        }
+    except Exception as e:
+        db.rollback()
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Error updating delivery mode: {str(e)}")
+        }
+    finally:
+        db.close()
+
 def lambda_handler(event, context):
     method = event['requestContext']['http']['method'].upper()
     email = get_user_email(event)
@@ -205,6 +259,14 @@ def lambda_handler(event, context):
         return add_subscriber(account_id, vendor_list_id, subscriber_email)
 
     elif method == 'GET':
+        preference_email = query_params.get('subscriber-email')
+        if preference_email:
+            if email != preference_email:
+                return {
+                    'statusCode': 403,
+                    'body': json.dumps("Forbidden: You can only view your own delivery mode.")
+                }
+            return get_delivery_mode(account_id, preference_email)
         return get_subscribers(account_id, vendor_list_id)
 
     elif method == 'DELETE':
@@ -226,6 +288,19 @@ def lambda_handler(event, context):
                 'statusCode': 400,
                 'body': json.dumps("PATCH only supports a single subscriber-email.")
             }
+        delivery_mode = data.get('delivery-mode')
+        if delivery_mode:
+            if email != subscriber_email:
+                return {
+                    'statusCode': 403,
+                    'body': json.dumps("Forbidden: You can only change your own delivery mode.")
+                }
+            if delivery_mode not in DELIVERY_MODES:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps(f"Invalid delivery-mode, expected one of: {', '.join(DELIVERY_MODES)}")
+                }
+            return set_delivery_mode(account_id, subscriber_email, delivery_mode)
         if email != subscriber_email:
             return {
                 'statusCode': 403,